@@ -1,171 +1,1690 @@
 #!/usr/bin/python3
 
-import argparse
+# Modules that are only needed by some functions (urllib, asyncio, sqlite3, ...) are imported where they are used,
+# so that importing nodesTk and running the command line interface stays fast.
+import array
+import codecs
+import contextlib
 import datetime
+import functools
+import heapq
+import io
+import itertools
 import json
+import math
+import mmap
+import operator
+import os
 import re
-import urllib.request
-from typing import Union
+import struct
+import sys
+import time
+
+
+class Instrumentation:
+    """
+    Collect timers and counters of nodesTk operations.
+
+    Pass one to a generate_* function or set it as Network.instrumentation to see where the time goes. Each phase
+    (fetching, JSON parsing, building nodes and links, computing meshes, tiers, uplinks, ...) is timed, and counters
+    record the nodes and links parsed, links scanned, neighbour lookups, BFS levels and the hits and misses of the
+    cached graph computations. The totals are kept in timers (seconds), calls and counters, and every measurement is
+    handed to the sinks, e.g. a LoggingSink, DictSink or PrometheusSink. Without an Instrumentation nothing is
+    measured.
+
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        self.timers = dict()  # phase as key and seconds as value
+        self.calls = dict()  # phase as key and number of runs as value
+        self.counters = dict()  # counter as key and value as value
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        for sink in self.sinks:
+            sink.add_time(phase, seconds)
+
+    def count(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+        for sink in self.sinks:
+            sink.count(counter, value)
+
+
+class LoggingSink:
+    """Log every measurement of an Instrumentation."""
+
+    def __init__(self, logger=None, level=None):
+        import logging
+        self.logger = logger or logging.getLogger('nodesTk')
+        self.level = logging.DEBUG if level is None else level
+
+    def add_time(self, phase, seconds):
+        self.logger.log(self.level, "%s took %.6f s", phase, seconds)
+
+    def count(self, counter, value):
+        self.logger.log(self.level, "%s += %d", counter, value)
+
+
+class DictSink:
+    """Add up the measurements of an Instrumentation in a dict, which can be shared by several of them."""
+
+    def __init__(self, target=None):
+        self.dict = dict() if target is None else target
+
+    def add_time(self, phase, seconds):
+        key = phase + '_seconds'
+        self.dict[key] = self.dict.get(key, 0.0) + seconds
+
+    def count(self, counter, value):
+        self.dict[counter] = self.dict.get(counter, 0) + value
+
+
+class PrometheusSink:
+    """Add up the measurements of an Instrumentation and render them in the Prometheus text format."""
+
+    def __init__(self, prefix='nodestk'):
+        self.prefix = prefix
+        self.seconds_dict = dict()
+        self.calls_dict = dict()
+        self.counters_dict = dict()
+
+    def add_time(self, phase, seconds):
+        self.seconds_dict[phase] = self.seconds_dict.get(phase, 0.0) + seconds
+        self.calls_dict[phase] = self.calls_dict.get(phase, 0) + 1
+
+    def count(self, counter, value):
+        self.counters_dict[counter] = self.counters_dict.get(counter, 0) + value
+
+    def render(self):
+        lines = []
+        for name, label, values, description in (
+                ('phase_seconds_total', 'phase', self.seconds_dict, "Time spent in nodesTk phases."),
+                ('phase_calls_total', 'phase', self.calls_dict, "Number of runs of nodesTk phases."),
+                ('events_total', 'counter', self.counters_dict, "nodesTk event counters.")):
+            metric = "{}_{}".format(self.prefix, name)
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} counter".format(metric))
+            for key, value in sorted(values.items()):
+                lines.append('{}{{{}="{}"}} {}'.format(metric, label, key, value))
+        return "\n".join(lines) + "\n"
+
+
+class _NullContext:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+def _phase(instrumentation, phase):
+    """Return a context manager that times the phase if instrumentation is not None."""
+    return _NULL_CONTEXT if instrumentation is None else instrumentation.timer(phase)
+
+
+def _instrumented(phase):
+    """Time a Network method as phase if the Network has an Instrumentation."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.instrumentation is None:
+                return method(self, *args, **kwargs)
+            with self.instrumentation.timer(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
 
 
 class Network:
     def __init__(self):
         self.nodes_dict = dict()  # node_id as key and Node obj as value
         self.links_dict = dict()  # node_ids alphabetically concatenated as key and Link obj as value
-        self.tiers_dict = dict()  # tier number as key and set of node_id as value
-        self.tier_nodes_set = set()  # a set of all node_id who already have a tier
+        self.adjacency_dict = dict()  # node_id as key and dict of neighbour node_id -> Link obj as value
+        self._tier_seeds_dict = dict()  # node_id as key and tier as value, for tiers that were set by hand
+        self.timestamp = None  # the timestamp string of the nodes.json, if known
+        self.domains_dict = dict()  # node_id as key and frozenset of domain names as value, see generate_from_domains()
+        self.instrumentation = None  # an Instrumentation that measures the graph computations, if wanted
 
         # A set of node IDs that are known to be VPN only (e.g. supernodes).
         # Use this if the VPN flags in your graph.json are known to be incorrect.
         self.vpn_only_nodes = set()
 
-    def add_link(self, newlink):
-        link = [newlink.source, newlink.target]
+        # Connected components over the mesh links, computed lazily by _update_meshes().
+        self._meshes_vpn_only_nodes = None  # copy of vpn_only_nodes the meshes were computed with, None if outdated
+        self._mesh_id_dict = dict()  # node_id as key and mesh id as value
+        self._meshes_dict = dict()  # mesh id as key and frozenset of node_id as value
+        self._fake_meshes_dict = dict()  # mesh id as key and frozenset of fake mesh connections as value
+        self._online_meshes_set = frozenset()  # all meshes that contain at least one online node
+        self._next_mesh_id = 0
+
+        # Hop distances to the gateways, computed lazily by _update_tiers().
+        self._tier_dict = None  # node_id as key and tier as value, None if outdated
+        self._tiers_dict = dict()  # tier as key and frozenset of node_id as value
+
+        # Best paths to the gateways by transmission quality, computed lazily by _update_uplinks().
+        self._uplink_cost_dict = None  # node_id as key and cost of the best path to a gateway as value
+        self._uplink_predecessor_dict = dict()  # node_id as key and next node_id on the way to the gateway as value
+
+        # Nodes and links whose failure cuts others off from the gateways, computed lazily by _update_critical().
+        self._critical_nodes_dict = None  # node_id as key and number of nodes that lose their uplink as value
+        self._critical_links_dict = dict()  # link id as key and number of nodes that lose their uplink as value
+
+        self._spatial_index = None  # SpatialIndex over the node locations, built lazily by get_spatial_index()
+        self._firmware_dict = None  # release as key and frozenset of node_id as value, built by get_firmware_index()
+        self._query_index_dict = dict()  # field as key and dict of value -> set of node_id as value, used by query()
+
+        # Statistics of the meshes, computed lazily mesh by mesh by get_mesh_summaries() and get_mesh_summary().
+        self._mesh_summary_dict = dict()  # mesh id as key and MeshSummary as value
+        self._network_summary = None  # MeshSummary over all online meshes, None if outdated
+
+    def _invalidate(self):
+        """Throw away everything that was derived from the nodes and links."""
+        self._meshes_vpn_only_nodes = None
+        self._tier_dict = None
+        self._uplink_cost_dict = None
+        self._critical_nodes_dict = None
+        self._spatial_index = None
+        self._firmware_dict = None
+        self._query_index_dict = dict()
+        self._drop_mesh_summaries()
+
+    def _drop_mesh_summaries(self, mesh_ids=None):
+        """Forget the MeshSummary of the given meshes, or of all meshes."""
+        if mesh_ids is None:
+            self._mesh_summary_dict = dict()
+        else:
+            for mesh_id in mesh_ids:
+                self._mesh_summary_dict.pop(mesh_id, None)
+        self._network_summary = None
+
+    def _phase(self, phase, cached=False):
+        """Return a context manager that times the phase if the Network is instrumented."""
+        if self.instrumentation is None:
+            return _NULL_CONTEXT
+        if cached:
+            self.instrumentation.count(phase + '_cache_misses')
+        return self.instrumentation.timer(phase)
+
+    def _count_links_scanned(self, node_ids):
+        """Count the links of node_ids as scanned if the Network is instrumented."""
+        if self.instrumentation is not None:
+            self.instrumentation.count('links_scanned',
+                                       sum(len(self.adjacency_dict.get(node_id, ())) for node_id in node_ids))
+
+    @staticmethod
+    def get_link_id(source, target):
+        link = [source, target]
         link.sort(key=str.lower)
-        self.links_dict["-".join(link)] = newlink  # now with 'Streckenstrich'(tm)
+        return "-".join(link)  # now with 'Streckenstrich'(tm)
+
+    def _add_link(self, newlink, link_id=None):
+        if link_id is None:
+            link_id = self.get_link_id(newlink.source, newlink.target)
+        if link_id in self.links_dict:
+            # A link between the same pair of nodes replaces the old one, so drop the old one from the index.
+            self._remove_link(link_id)
+        self.links_dict[link_id] = newlink
+        self.adjacency_dict.setdefault(newlink.source, dict())[newlink.target] = newlink
+        self.adjacency_dict.setdefault(newlink.target, dict())[newlink.source] = newlink
+
+    def _remove_link(self, link_id):
+        link = self.links_dict.pop(link_id)
+        for node_id, other_node_id in ((link.source, link.target), (link.target, link.source)):
+            neighbours = self.adjacency_dict.get(node_id)
+            if neighbours is not None:
+                neighbours.pop(other_node_id, None)
+                if not neighbours:
+                    del self.adjacency_dict[node_id]
+        return link
+
+    def add_link(self, newlink):
+        self._add_link(newlink)
+        self._invalidate()
+
+    def remove_link(self, link_id):
+        """Remove the link with the given id and return it."""
+        link = self._remove_link(link_id)
+        self._invalidate()
+        return link
 
     def add_node(self, node):
         self.nodes_dict[node.node_id] = node
-        if node.is_gateway:
-            self.add_node_to_tier(node.node_id, 0)
+        self._invalidate()
+
+    def remove_node(self, node_id):
+        """Remove the node with the given id and return it. Its links are kept."""
+        node = self.nodes_dict.pop(node_id)
+        self._invalidate()
+        return node
 
     def get_node(self, node_id):
         return self.nodes_dict[node_id]
 
+    def get_domains_of_node(self, node_id):
+        """Return the frozenset of domains the node was seen in, empty if the Network was not built from domains."""
+        return self.domains_dict.get(node_id, frozenset())
+
+    def get_nodes_of_domain(self, domain):
+        return {node_id for node_id, domains in self.domains_dict.items() if domain in domains}
+
     def add_node_to_tier(self, node_id, tier):
-        if node_id in self.tier_nodes_set:
+        """
+        Use the node as an additional starting point for the tier computation.
+
+        Gateways are always in tier 0. A node that already got a tier this way keeps it.
+
+        """
+        if node_id in self._tier_seeds_dict:
             return
-        if tier not in self.tiers_dict:
-            self.tiers_dict[tier] = set()
-        self.tiers_dict[tier].add(node_id)
-        self.tier_nodes_set.add(node_id)
+        self._tier_seeds_dict[node_id] = tier
+        self._tier_dict = None
+        self._query_index_dict.pop('tier', None)
 
     def get_neighbours_of_node(self, node_id, vpn_neighbours=False):
         return self.get_neighbours_of_node_find_fake_meshes(node_id, vpn_neighbours)[0]
 
     def get_neighbours_of_node_find_fake_meshes(self, node_id, vpn_neighbours=False):
+        if self.instrumentation is not None:
+            self.instrumentation.count('neighbour_lookups')
+            self._count_links_scanned((node_id,))
+        node = self.nodes_dict.get(node_id)
+        if node is None and node_id not in self.adjacency_dict:
+            raise KeyError(node_id)
+        mesh_neighbours_set = set()
+        vpn_neighbours_set = set()
         fake_mesh_connections = set()
-        if not self.nodes_dict[node_id].mesh_neighbours_set or not self.nodes_dict[node_id].vpn_neighbours_set:
-            self.nodes_dict[node_id].mesh_neighbours_set = set()
-            self.nodes_dict[node_id].vpn_neighbours_set = set()
-            for link_id in self.links_dict:
-                other_node_id = None
-                if self.links_dict[link_id].source == node_id:
-                    other_node_id = self.links_dict[link_id].target
-                elif self.links_dict[link_id].target == node_id:
-                    other_node_id = self.links_dict[link_id].source
-
-                if other_node_id:
-                    if self.links_dict[link_id].vpn:
-                        self.nodes_dict[node_id].vpn_neighbours_set.add(other_node_id)
-                    elif node_id in self.vpn_only_nodes or other_node_id in self.vpn_only_nodes:
-                        # This connection is marked as non-VPN but one of the nodes is a known VPN only host.
-                        # Therefore this must be a VPN connection.
-                        fake_mesh_connections.add(frozenset((node_id, other_node_id)))
-                        self.nodes_dict[node_id].vpn_neighbours_set.add(other_node_id)
-                    else:
-                        self.nodes_dict[node_id].mesh_neighbours_set.add(other_node_id)
+        # The classification is done on every call, so later changes to vpn_only_nodes are respected.
+        node_is_vpn_only = node_id in self.vpn_only_nodes
+        for other_node_id, link in self.adjacency_dict.get(node_id, {}).items():
+            if link.vpn:
+                vpn_neighbours_set.add(other_node_id)
+            elif node_is_vpn_only or other_node_id in self.vpn_only_nodes:
+                # This connection is marked as non-VPN but one of the nodes is a known VPN only host.
+                # Therefore this must be a VPN connection.
+                fake_mesh_connections.add(frozenset((node_id, other_node_id)))
+                vpn_neighbours_set.add(other_node_id)
+            else:
+                mesh_neighbours_set.add(other_node_id)
+        # A node that only appears in the graph.json has no Node to keep the sets on.
+        if node is not None:
+            node.mesh_neighbours_set = mesh_neighbours_set
+            node.vpn_neighbours_set = vpn_neighbours_set
 
         if vpn_neighbours:
-            result = self.nodes_dict[node_id].mesh_neighbours_set.union(self.nodes_dict[node_id].vpn_neighbours_set)
+            result = mesh_neighbours_set.union(vpn_neighbours_set)
         else:
-            result = self.nodes_dict[node_id].mesh_neighbours_set
+            result = mesh_neighbours_set
 
         return result, fake_mesh_connections
 
+    def _label_mesh(self, start_node_id, mesh_id, mesh_id_dict, vpn_only_nodes):
+        """Label all nodes in the mesh of start_node_id and return a frozenset of them and of the fake connections."""
+        mesh_id_dict[start_node_id] = mesh_id
+        mesh_nodes = [start_node_id]
+        fake_mesh_connections = set()
+        todo = [start_node_id]
+        while todo:
+            node_id = todo.pop()
+            node_is_vpn_only = node_id in vpn_only_nodes
+            for other_node_id, link in self.adjacency_dict.get(node_id, {}).items():
+                if link.vpn:
+                    continue
+                if node_is_vpn_only or other_node_id in vpn_only_nodes:
+                    fake_mesh_connections.add(frozenset((node_id, other_node_id)))
+                    continue
+                if other_node_id not in mesh_id_dict:
+                    mesh_id_dict[other_node_id] = mesh_id
+                    mesh_nodes.append(other_node_id)
+                    todo.append(other_node_id)
+        return frozenset(mesh_nodes), frozenset(fake_mesh_connections)
+
+    def _update_meshes(self):
+        """
+        Label every node with the id of the mesh it belongs to.
+
+        This is a single pass over all nodes and links, the result is kept until the graph or vpn_only_nodes change.
+
+        """
+        vpn_only_nodes = frozenset(self.vpn_only_nodes)
+        if self._meshes_vpn_only_nodes == vpn_only_nodes:
+            if self.instrumentation is not None:
+                self.instrumentation.count('meshes_cache_hits')
+            return
+        with self._phase('meshes', cached=True):
+            self._compute_meshes(vpn_only_nodes)
+
+    def _compute_meshes(self, vpn_only_nodes):
+        mesh_id_dict = dict()
+        meshes_dict = dict()
+        fake_meshes_dict = dict()
+        for start_node_id in itertools.chain(self.nodes_dict, self.adjacency_dict):
+            if start_node_id in mesh_id_dict:
+                continue
+            mesh_id = len(meshes_dict)
+            meshes_dict[mesh_id], fake_meshes_dict[mesh_id] = self._label_mesh(start_node_id, mesh_id, mesh_id_dict,
+                                                                               vpn_only_nodes)
+
+        self._mesh_id_dict = mesh_id_dict
+        self._meshes_dict = meshes_dict
+        self._drop_mesh_summaries()
+        self._fake_meshes_dict = fake_meshes_dict
+        self._online_meshes_set = frozenset(meshes_dict[mesh_id_dict[node_id]]
+                                            for node_id, node in self.nodes_dict.items() if node.is_online)
+        self._next_mesh_id = len(meshes_dict)
+        self._meshes_vpn_only_nodes = vpn_only_nodes
+        self._count_links_scanned(mesh_id_dict)
+
+    @_instrumented('repair_meshes')
+    def _repair_meshes(self, dirty_nodes):
+        """
+        Relabel only the meshes that contain one of dirty_nodes, after nodes or links of them changed.
+
+        Returns a set of the splits, each a tuple of the old mesh and a frozenset of the meshes it fell apart into, and
+        a set of the merges, each a tuple of a frozenset of the old meshes and the mesh they became.
+
+        """
+        retired_mesh_ids = {self._mesh_id_dict[node_id] for node_id in dirty_nodes if node_id in self._mesh_id_dict}
+        # Every link that was added or removed has both ends in dirty_nodes, so the new meshes can only consist of
+        # nodes from the retired meshes and the dirty nodes.
+        start_node_ids = set(dirty_nodes)
+        retired_meshes = set()
+        self._drop_mesh_summaries(retired_mesh_ids)
+        for mesh_id in retired_mesh_ids:
+            mesh = self._meshes_dict.pop(mesh_id)
+            del self._fake_meshes_dict[mesh_id]
+            retired_meshes.add(mesh)
+            start_node_ids.update(mesh)
+        for node_id in start_node_ids:
+            self._mesh_id_dict.pop(node_id, None)
+
+        online_meshes = set()
+        for start_node_id in start_node_ids:
+            if start_node_id in self._mesh_id_dict:
+                continue
+            if start_node_id not in self.nodes_dict and start_node_id not in self.adjacency_dict:
+                continue  # gone for good
+            mesh_id = self._next_mesh_id
+            self._next_mesh_id += 1
+            mesh, fakes = self._label_mesh(start_node_id, mesh_id, self._mesh_id_dict, self._meshes_vpn_only_nodes)
+            self._meshes_dict[mesh_id] = mesh
+            self._fake_meshes_dict[mesh_id] = fakes
+            if any(node_id in self.nodes_dict and self.nodes_dict[node_id].is_online for node_id in mesh):
+                online_meshes.add(mesh)
+        self._online_meshes_set = self._online_meshes_set.difference(retired_meshes).union(online_meshes)
+        self._count_links_scanned(start_node_ids)
+
+        mesh_splits = set()
+        retired_mesh_dict = dict()
+        for mesh in retired_meshes:
+            new_meshes = frozenset(self._meshes_dict[self._mesh_id_dict[node_id]]
+                                   for node_id in mesh if node_id in self._mesh_id_dict)
+            if len(new_meshes) > 1:
+                mesh_splits.add((mesh, new_meshes))
+            retired_mesh_dict.update(dict.fromkeys(mesh, mesh))
+        mesh_merges = set()
+        for mesh in {self._meshes_dict[self._mesh_id_dict[node_id]] for node_id in retired_mesh_dict
+                     if node_id in self._mesh_id_dict}:
+            old_meshes = frozenset(retired_mesh_dict[node_id] for node_id in mesh if node_id in retired_mesh_dict)
+            if len(old_meshes) > 1:
+                mesh_merges.add((old_meshes, mesh))
+        return mesh_splits, mesh_merges
+
+    def get_mesh_id_of_node(self, node_id):
+        """Return the id of the mesh the node belongs to. Ids are only stable until the graph changes."""
+        self._update_meshes()
+        return self._mesh_id_dict[node_id]
+
     def get_mesh_of_node(self, node_id):
         return self.get_mesh_of_node_find_fake_meshes(node_id)[0]
 
     def get_mesh_of_node_find_fake_meshes(self, node_id):
-        mesh_nodes_set = {node_id}
-        fake_mesh_connections = set()
-        last_len = 0
-        # while mesh_nodes_set is growing...
-        while last_len != len(mesh_nodes_set):
-            last_len = len(mesh_nodes_set)
-            for mesh_node in mesh_nodes_set:
-                neighbours, fakes = self.get_neighbours_of_node_find_fake_meshes(mesh_node, vpn_neighbours=False)
-                mesh_nodes_set = mesh_nodes_set.union(neighbours)
-                fake_mesh_connections = fake_mesh_connections.union(fakes)
-        return mesh_nodes_set, fake_mesh_connections
+        """Return a frozenset of all node_ids in the mesh of the node and a frozenset of its fake mesh connections."""
+        mesh_id = self.get_mesh_id_of_node(node_id)
+        return self._meshes_dict[mesh_id], self._fake_meshes_dict[mesh_id]
 
     def get_meshes(self):
-        meshes_set = set()
-        for node_id in self.nodes_dict:
-            if self.get_node(node_id).is_online:
-                mesh_nodes_set = self.get_mesh_of_node(node_id)
-                meshes_set.add(frozenset(mesh_nodes_set))
-        return meshes_set
+        """Return a frozenset of all meshes (each a frozenset of node_ids) with at least one online node."""
+        self._update_meshes()
+        return self._online_meshes_set
 
-    def get_nodes_in_tier(self, tier):
-        if 0 not in self.tiers_dict:
-            return set()  # If not even tier 0 is filled we can skip this shit and go home.
+    def _summarize_mesh(self, mesh_id):
+        mesh = self._meshes_dict[mesh_id]
+        summary = MeshSummary(mesh_id, mesh)
+        release_counts = summary.release_counts
+        vpn_only_nodes = self._meshes_vpn_only_nodes
+        for node_id in mesh:
+            node = self.nodes_dict.get(node_id)
+            if node is not None:
+                summary.node_count += 1
+                release_counts[node.release] = release_counts.get(node.release, 0) + 1
+                if node.is_online:
+                    summary.online_count += 1
+                    summary.client_count += node.client_count or 0
+                    if node.is_gateway:
+                        summary.gateway_count += 1
+            tier = self._tier_dict.get(node_id)
+            if tier is not None:
+                if summary.min_tier is None or tier < summary.min_tier:
+                    summary.min_tier = tier
+                if summary.max_tier is None or tier > summary.max_tier:
+                    summary.max_tier = tier
+            if node_id in vpn_only_nodes:
+                continue
+            for other_node_id, link in self.adjacency_dict.get(node_id, {}).items():
+                # Every mesh link is seen from both ends, count it once.
+                if link.vpn or other_node_id in vpn_only_nodes or other_node_id < node_id:
+                    continue
+                quality = link.tq_percent
+                summary.link_count += 1
+                summary._link_quality_sum += quality
+                if summary.min_link_quality is None or quality < summary.min_link_quality:
+                    summary.min_link_quality = quality
+        self._mesh_summary_dict[mesh_id] = summary
+        return summary
 
-        for i in range(tier):
-            if i+1 in self.tiers_dict:
-                continue  # The next tier already exists? Fine.
-            # Next tier does not exist, so we'll create it.
-            tier_set = set()
-            for node_id in self.tiers_dict[i]:  # Iterate over all nodes in the current tier.
-                # Add all neighbours of this node to the set for the next tier.
-                tier_set = tier_set.union(self.get_neighbours_of_node(node_id, vpn_neighbours=True))
-            # Remove all node_ids that are already part of a tier.
-            tier_set = tier_set.difference(self.tier_nodes_set)
-            self.tiers_dict[i+1] = tier_set
-            self.tier_nodes_set = self.tier_nodes_set.union(tier_set)
+    def get_mesh_summary(self, node_id):
+        """Return the MeshSummary of the mesh the node belongs to. It is kept until the mesh changes."""
+        self._update_meshes()
+        self._update_tiers()
+        mesh_id = self._mesh_id_dict[node_id]
+        summary = self._mesh_summary_dict.get(mesh_id)
+        return summary if summary is not None else self._summarize_mesh(mesh_id)
 
-        return self.tiers_dict[tier]
+    def get_mesh_summaries(self):
+        """
+        Return a dict with the mesh id as key and the MeshSummary as value for all meshes with an online node.
 
+        The summaries are computed in one pass over the meshes and kept until the meshes change. After
+        Network.update() only the summaries of the meshes that changed are computed again.
 
-class Node:
-    def __init__(self, json_representation):
-        self.json = json_representation
-        self.mesh_neighbours_set = None
-        self.vpn_neighbours_set = None
+        """
+        self._update_meshes()
+        self._update_tiers()
+        summaries = dict()
+        with self._phase('mesh_summaries'):
+            for mesh in self._online_meshes_set:
+                mesh_id = self._mesh_id_dict[next(iter(mesh))]
+                summary = self._mesh_summary_dict.get(mesh_id)
+                summaries[mesh_id] = summary if summary is not None else self._summarize_mesh(mesh_id)
+        return summaries
 
-    @property
-    def node_id(self):
-        return self.json['nodeinfo']['node_id']
+    def get_network_summary(self):
+        """Return a MeshSummary combined over all meshes with an online node."""
+        summaries = self.get_mesh_summaries()
+        if self._network_summary is None:
+            self._network_summary = MeshSummary.combine(summaries.values())
+        return self._network_summary
 
-    @property
-    def is_gateway(self):
-        return self.json['flags']['gateway']
+    def get_top_meshes_by_clients(self, count):
+        """Return a list of the MeshSummary of the count meshes with the most clients, most clients first."""
+        return heapq.nlargest(count, self.get_mesh_summaries().values(),
+                              key=lambda summary: (summary.client_count, -summary.mesh_id))
+
+    def _update_tiers(self):
+        """
+        Compute the tier (hops to the nearest gateway) of every node.
+
+        This is one breadth-first search starting from all gateways at once. The result is kept until the graph
+        changes.
+
+        """
+        if self._tier_dict is not None:
+            if self.instrumentation is not None:
+                self.instrumentation.count('tiers_cache_hits')
+            return
+        with self._phase('tiers', cached=True):
+            self._compute_tiers()
+
+    def _compute_tiers(self):
+        seeds = [(0, node_id) for node_id, node in self.nodes_dict.items() if node.is_gateway]
+        seeds.extend((tier, node_id) for node_id, tier in self._tier_seeds_dict.items())
+        seeds.sort(key=lambda seed: seed[0])
+
+        tier_dict = dict()
+        tiers_dict = dict()
+        frontier = []
+        tier = 0
+        seed_index = 0
+        while frontier or seed_index < len(seeds):
+            if not frontier:
+                tier = seeds[seed_index][0]
+            while seed_index < len(seeds) and seeds[seed_index][0] == tier:
+                node_id = seeds[seed_index][1]
+                seed_index += 1
+                if node_id not in tier_dict:
+                    tier_dict[node_id] = tier
+                    frontier.append(node_id)
+            if frontier:
+                tiers_dict[tier] = frozenset(frontier)
+            next_frontier = []
+            for node_id in frontier:
+                for other_node_id in self.adjacency_dict.get(node_id, ()):
+                    if other_node_id not in tier_dict:
+                        tier_dict[other_node_id] = tier + 1
+                        next_frontier.append(other_node_id)
+            frontier = next_frontier
+            tier += 1
+
+        self._tiers_dict = tiers_dict
+        self._tier_dict = tier_dict
+        self._drop_mesh_summaries()
+        self._count_links_scanned(tier_dict)
+        if self.instrumentation is not None:
+            self.instrumentation.count('bfs_levels', len(tiers_dict))
+
+    def _seed_tier(self, node_id):
+        """Return the tier a node starts with in the tier computation, or None if it is no starting point."""
+        node = self.nodes_dict.get(node_id)
+        if node is not None and node.is_gateway:
+            return 0
+        return self._tier_seeds_dict.get(node_id)
+
+    @_instrumented('repair_tiers')
+    def _repair_tiers(self, dirty_nodes):
+        """
+        Update the tiers after nodes or links around dirty_nodes changed and return the changes.
+
+        First the tiers of all nodes that lost their shortest way to a gateway are dropped, then the tiers of those
+        nodes and of everything that got a shorter way are settled again. Returns a dict with the node_id as key and
+        a tuple of old and new tier as value.
+
+        """
+        tier_dict = self._tier_dict
+        old_tier_dict = dict()
+
+        def set_tier(node_id, tier):
+            if node_id not in old_tier_dict:
+                old_tier_dict[node_id] = tier_dict.get(node_id)
+            if tier is None:
+                del tier_dict[node_id]
+            else:
+                tier_dict[node_id] = tier
+
+        heap = [(tier_dict[node_id], node_id) for node_id in dirty_nodes if node_id in tier_dict]
+        heapq.heapify(heap)
+        dropped_nodes = []
+        while heap:
+            tier, node_id = heapq.heappop(heap)
+            if tier_dict.get(node_id) != tier or self._seed_tier(node_id) == tier:
+                continue
+            neighbours = self.adjacency_dict.get(node_id, ())
+            if any(tier_dict.get(other_node_id) == tier - 1 for other_node_id in neighbours):
+                continue
+            set_tier(node_id, None)
+            dropped_nodes.append(node_id)
+            for other_node_id in neighbours:
+                if tier_dict.get(other_node_id) == tier + 1:
+                    heapq.heappush(heap, (tier + 1, other_node_id))
+
+        heap = []
+        for node_id in itertools.chain(dropped_nodes, dirty_nodes):
+            best_tier = self._seed_tier(node_id)
+            for other_node_id in self.adjacency_dict.get(node_id, ()):
+                other_tier = tier_dict.get(other_node_id)
+                if other_tier is not None and (best_tier is None or other_tier + 1 < best_tier):
+                    best_tier = other_tier + 1
+            current_tier = tier_dict.get(node_id)
+            if best_tier is not None and (current_tier is None or best_tier < current_tier):
+                set_tier(node_id, best_tier)
+                heapq.heappush(heap, (best_tier, node_id))
+            elif current_tier is not None:
+                heapq.heappush(heap, (current_tier, node_id))
+        while heap:
+            tier, node_id = heapq.heappop(heap)
+            if tier_dict.get(node_id) != tier:
+                continue
+            for other_node_id in self.adjacency_dict.get(node_id, ()):
+                other_tier = tier_dict.get(other_node_id)
+                if other_tier is None or tier + 1 < other_tier:
+                    set_tier(other_node_id, tier + 1)
+                    heapq.heappush(heap, (tier + 1, other_node_id))
+
+        tier_changes = dict()
+        removed_dict = dict()
+        added_dict = dict()
+        for node_id, old_tier in old_tier_dict.items():
+            new_tier = tier_dict.get(node_id)
+            if old_tier == new_tier:
+                continue
+            tier_changes[node_id] = (old_tier, new_tier)
+            if old_tier is not None:
+                removed_dict.setdefault(old_tier, set()).add(node_id)
+            if new_tier is not None:
+                added_dict.setdefault(new_tier, set()).add(node_id)
+        for tier in set(removed_dict).union(added_dict):
+            nodes = self._tiers_dict.get(tier, frozenset()).difference(removed_dict.get(tier, ()))
+            nodes = nodes.union(added_dict.get(tier, ()))
+            if nodes:
+                self._tiers_dict[tier] = nodes
+            else:
+                self._tiers_dict.pop(tier, None)
+        return tier_changes
 
     @property
-    def is_online(self):
-        return self.json['flags']['online']
+    def tiers_dict(self):
+        """Return a dict with the tier as key and a frozenset of node_id as value."""
+        self._update_tiers()
+        return self._tiers_dict
 
     @property
-    def version(self):
+    def tier_nodes_set(self):
+        """Return a set of all node_id that have a tier."""
+        self._update_tiers()
+        return set(self._tier_dict)
+
+    def get_nodes_in_tier(self, tier):
+        self._update_tiers()
+        return self._tiers_dict.get(tier, frozenset())
+
+    def get_tier_of_node(self, node_id):
+        """Return the tier of the node, or None if it has no connection to a gateway."""
+        self._update_tiers()
+        return self._tier_dict.get(node_id)
+
+    def get_tier_histogram(self):
+        """Return a dict with the tier as key and the number of nodes in that tier as value."""
+        self._update_tiers()
+        return {tier: len(nodes) for tier, nodes in sorted(self._tiers_dict.items())}
+
+    @staticmethod
+    def _link_cost(link):
+        """Return the cost of a link for path searches, the cost of a path is -log of its transmission quality."""
+        return math.log(max(link.tq, 1.0))
+
+    def _update_uplinks(self):
+        """
+        Find the path with the best transmission quality from every node to any gateway.
+
+        This is one Dijkstra search starting from all gateways at once, the quality of a path is the product of the
+        tq_percent of its links. The result is kept until the graph changes.
+
+        """
+        if self._uplink_cost_dict is not None:
+            if self.instrumentation is not None:
+                self.instrumentation.count('uplinks_cache_hits')
+            return
+        with self._phase('uplinks', cached=True):
+            self._compute_uplinks()
+
+    def _compute_uplinks(self):
+        cost_dict = dict()
+        predecessor_dict = dict()
+        heap = []
+        for node_id, node in self.nodes_dict.items():
+            if node.is_gateway:
+                cost_dict[node_id] = 0.0
+                predecessor_dict[node_id] = None
+                heap.append((0.0, node_id))
+        heapq.heapify(heap)
+        while heap:
+            cost, node_id = heapq.heappop(heap)
+            if cost > cost_dict[node_id]:
+                continue
+            for other_node_id, link in self.adjacency_dict.get(node_id, {}).items():
+                other_cost = cost + self._link_cost(link)
+                if other_cost < cost_dict.get(other_node_id, math.inf):
+                    cost_dict[other_node_id] = other_cost
+                    predecessor_dict[other_node_id] = node_id
+                    heapq.heappush(heap, (other_cost, other_node_id))
+
+        self._uplink_predecessor_dict = predecessor_dict
+        self._uplink_cost_dict = cost_dict
+        self._count_links_scanned(cost_dict)
+
+    def get_uplink_quality(self, node_id):
+        """Return the transmission quality (0 to 1) of the best path to a gateway, or None if there is none."""
+        self._update_uplinks()
+        cost = self._uplink_cost_dict.get(node_id)
+        return None if cost is None else math.exp(-cost)
+
+    def get_uplink_qualities(self):
+        """Return a dict with the node_id as key and the quality of its best path to a gateway as value."""
+        self._update_uplinks()
+        return {node_id: math.exp(-cost) for node_id, cost in self._uplink_cost_dict.items()}
+
+    def get_uplink_path(self, node_id):
+        """Return the list of node_ids on the best path from the node to a gateway, or None if there is none."""
+        self._update_uplinks()
+        if node_id not in self._uplink_cost_dict:
+            return None
+        path = [node_id]
+        while self._uplink_predecessor_dict[path[-1]] is not None:
+            path.append(self._uplink_predecessor_dict[path[-1]])
+        return path
+
+    def get_best_path(self, source, target):
+        """Return a tuple of the quality and the list of node_ids of the best path between two nodes, or None."""
+        cost_dict = {source: 0.0}
+        predecessor_dict = {source: None}
+        heap = [(0.0, source)]
+        while heap:
+            cost, node_id = heapq.heappop(heap)
+            if node_id == target:
+                path = [target]
+                while predecessor_dict[path[-1]] is not None:
+                    path.append(predecessor_dict[path[-1]])
+                return math.exp(-cost), path[::-1]
+            if cost > cost_dict[node_id]:
+                continue
+            for other_node_id, link in self.adjacency_dict.get(node_id, {}).items():
+                other_cost = cost + self._link_cost(link)
+                if other_cost < cost_dict.get(other_node_id, math.inf):
+                    cost_dict[other_node_id] = other_cost
+                    predecessor_dict[other_node_id] = node_id
+                    heapq.heappush(heap, (other_cost, other_node_id))
+        return None
+
+    def _update_critical(self):
+        """
+        Find the articulation points and bridges between the nodes and the gateways.
+
+        This is a single iterative depth-first search in Tarjan's style over all links, starting from a virtual root
+        that is connected to every gateway. A node whose DFS child can not reach anything discovered before the node
+        except through it is an articulation point, the whole subtree of that child loses its uplink if the node fails.
+        The same goes for links to a child that can not reach the parent or anything above it any other way.
+
+        """
+        if self._critical_nodes_dict is not None:
+            if self.instrumentation is not None:
+                self.instrumentation.count('critical_cache_hits')
+            return
+        with self._phase('critical', cached=True):
+            self._compute_critical()
+
+    def _compute_critical(self):
+        gateways = [node_id for node_id, node in self.nodes_dict.items() if node.is_gateway]
+        gateway_set = set(gateways)
+        root = None  # the virtual root, it is connected to all gateways
+        discovery_dict = {root: 0}
+        low_dict = {root: 0}
+        size_dict = {root: 0}
+        critical_nodes_dict = dict()
+        critical_links_dict = dict()
+        stack = [(root, None, iter(gateways))]
+        while stack:
+            node_id, parent_id, neighbours = stack[-1]
+            for other_node_id in neighbours:
+                if other_node_id == parent_id or other_node_id == node_id:
+                    continue
+                if other_node_id in discovery_dict:
+                    low_dict[node_id] = min(low_dict[node_id], discovery_dict[other_node_id])
+                    continue
+                discovery_dict[other_node_id] = low_dict[other_node_id] = len(discovery_dict)
+                if other_node_id in gateway_set:
+                    low_dict[other_node_id] = 0  # it has its own link to the virtual root
+                size_dict[other_node_id] = 1
+                stack.append((other_node_id, node_id, iter(self.adjacency_dict.get(other_node_id, ()))))
+                break
+            else:
+                stack.pop()
+                if node_id is root:
+                    continue
+                low_dict[parent_id] = min(low_dict[parent_id], low_dict[node_id])
+                size_dict[parent_id] += size_dict[node_id]
+                if parent_id is root:
+                    continue
+                if low_dict[node_id] >= discovery_dict[parent_id]:
+                    critical_nodes_dict[parent_id] = critical_nodes_dict.get(parent_id, 0) + size_dict[node_id]
+                if low_dict[node_id] > discovery_dict[parent_id]:
+                    critical_links_dict[self.get_link_id(parent_id, node_id)] = size_dict[node_id]
+
+        self._critical_links_dict = critical_links_dict
+        self._critical_nodes_dict = critical_nodes_dict
+        self._count_links_scanned(discovery_dict)
+
+    def get_critical_nodes(self):
+        """
+        Return a dict of the nodes whose failure cuts other nodes off from all gateways.
+
+        The node_id is the key and the number of nodes that lose their uplink is the value.
+
+        """
+        self._update_critical()
+        return self._critical_nodes_dict
+
+    def get_critical_links(self):
+        """
+        Return a dict of the links whose failure cuts nodes off from all gateways.
+
+        The link id is the key and the number of nodes that lose their uplink is the value.
+
+        """
+        self._update_critical()
+        return self._critical_links_dict
+
+    def get_spatial_index(self):
+        """Return a SpatialIndex over the locations of all nodes, it is kept until the graph changes."""
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex((node_id, node.location) for node_id, node in self.nodes_dict.items())
+        return self._spatial_index
+
+    def is_mesh_link(self, node_id, other_node_id):
+        """Return whether the two nodes have a direct mesh link, which is no VPN link and no fake mesh connection."""
+        link = self.adjacency_dict.get(node_id, {}).get(other_node_id)
+        return (link is not None and not link.vpn and node_id not in self.vpn_only_nodes
+                and other_node_id not in self.vpn_only_nodes)
+
+    def is_fake_mesh_link(self, link):
+        """Return whether the link is not flagged as VPN link but touches a VPN only node, see vpn_only_nodes."""
+        return not link.vpn and (link.source in self.vpn_only_nodes or link.target in self.vpn_only_nodes)
+
+    def get_missed_mesh_opportunities(self, metres):
+        """Return a list of (node_id, node_id, distance) for all nodes within metres that are no mesh neighbours."""
+        return [pair for pair in self.get_spatial_index().close_pairs(metres)
+                if not self.is_mesh_link(pair[0], pair[1])]
+
+    def get_firmware_index(self):
+        """Return a dict with the firmware release as key and a frozenset of node_id as value, oldest first."""
+        if self._firmware_dict is None:
+            firmware_dict = dict()
+            for node_id, node in self.nodes_dict.items():
+                firmware_dict.setdefault(node.release, []).append(node_id)
+            # Nodes without a release come first.
+            releases = sorted(firmware_dict, key=lambda release: (release is not None, release and Version(release)))
+            self._firmware_dict = {release: frozenset(firmware_dict[release]) for release in releases}
+        return self._firmware_dict
+
+    def get_firmware_histogram(self):
+        """Return a dict with the firmware release as key and the number of nodes running it as value, oldest first."""
+        return {release: len(nodes) for release, nodes in self.get_firmware_index().items()}
+
+    def get_nodes_older_than(self, version):
+        """Return a set of all node_ids with a firmware older than version (a Version or version string)."""
+        if not isinstance(version, Version):
+            version = Version(version)
+        result = set()
+        for release, nodes in self.get_firmware_index().items():
+            if release is not None and Version(release) < version:
+                result.update(nodes)
+        return result
+
+    # The fields query() knows, with a function that returns the value for a node_id and Node obj.
+    _query_fields = {
+        'node_id': lambda net, node_id, node: node_id,
+        'hostname': lambda net, node_id, node: node.hostname,
+        'online': lambda net, node_id, node: node.is_online,
+        'gateway': lambda net, node_id, node: node.is_gateway,
+        'client_count': lambda net, node_id, node: node.client_count,
+        'release': lambda net, node_id, node: node.version,
+        'location': lambda net, node_id, node: node.location,
+        'tier': lambda net, node_id, node: net.get_tier_of_node(node_id),
+        'mesh_id': lambda net, node_id, node: net.get_mesh_id_of_node(node_id),
+        'uplink_quality': lambda net, node_id, node: net.get_uplink_quality(node_id),
+    }
+    # Fields with a secondary index that query() builds on first use.
+    _query_indexed_fields = ('online', 'gateway', 'release', 'tier')
+    _query_operators = {
+        'eq': operator.eq,
+        'ne': operator.ne,
+        'lt': operator.lt,
+        'lte': operator.le,
+        'gt': operator.gt,
+        'gte': operator.ge,
+        'in': lambda value, values: value in values,
+        'isnull': lambda value, isnull: (value is None) == isnull,
+    }
+
+    def _get_query_index(self, field):
+        if field not in self._query_index_dict:
+            index = dict()
+            getter = self._query_fields[field]
+            for node_id, node in self.nodes_dict.items():
+                index.setdefault(getter(self, node_id, node), set()).add(node_id)
+            self._query_index_dict[field] = index
+        return self._query_index_dict[field]
+
+    def query(self, **conditions):
+        """
+        Return an iterator over the node_ids of all nodes that match all conditions.
+
+        Conditions are given as field=value or field__operator=value, for example
+        net.query(online=True, tier__gte=2, client_count__gt=10). The fields are the keys of _query_fields, the
+        operators eq (the default), ne, lt, lte, gt, gte, in and isnull. Releases are compared as Version, so strings
+        work, too. Nodes whose value is None never match an ordering operator.
+
+        The conditions on online, gateway, release and tier are answered from secondary indexes, whose node sets get
+        intersected, and only the remaining conditions are checked node by node while iterating.
+
+        """
+        parsed_conditions = []
+        for key, value in conditions.items():
+            field, _, operator_name = key.partition('__')
+            operator_name = operator_name or 'eq'
+            if field not in self._query_fields:
+                raise ValueError("Unknown field {!r}".format(field))
+            if operator_name not in self._query_operators:
+                raise ValueError("Unknown operator {!r}".format(operator_name))
+            if field == 'release' and operator_name != 'isnull':
+                if operator_name == 'in':
+                    value = {Version(release) if isinstance(release, str) else release for release in value}
+                elif isinstance(value, str):
+                    value = Version(value)
+            parsed_conditions.append((field, operator_name, value))
+        return self._query(parsed_conditions)
+
+    def _query(self, conditions):
+        candidate_sets = []
+        remaining_conditions = []
+        for field, operator_name, value in conditions:
+            if field not in self._query_indexed_fields or operator_name == 'isnull':
+                remaining_conditions.append((field, operator_name, value))
+                continue
+            compare = self._query_operators[operator_name]
+            candidates = set()
+            for indexed_value, node_ids in self._get_query_index(field).items():
+                if indexed_value is None and operator_name not in ('eq', 'ne', 'in'):
+                    continue
+                if compare(indexed_value, value):
+                    candidates.update(node_ids)
+            candidate_sets.append(candidates)
+
+        if candidate_sets:
+            candidate_sets.sort(key=len)
+            node_ids = candidate_sets[0].intersection(*candidate_sets[1:])
+        else:
+            node_ids = self.nodes_dict
+
+        for node_id in node_ids:
+            node = self.nodes_dict[node_id]
+            for field, operator_name, value in remaining_conditions:
+                field_value = self._query_fields[field](self, node_id, node)
+                if field_value is None and operator_name not in ('eq', 'ne', 'in', 'isnull'):
+                    break
+                if not self._query_operators[operator_name](field_value, value):
+                    break
+            else:
+                yield node_id
+
+    def to_sparse(self):
+        """Return a SparseGraph of this Network for vectorized analytics. Needs NumPy and SciPy."""
+        return SparseGraph(self)
+
+    @_instrumented('update')
+    def update(self, new_net):
+        """
+        Turn this Network into new_net (usually built from a newer snapshot) by applying only the differences.
+
+        Meshes and tiers are repaired around the changed nodes and links instead of being computed again. The
+        vpn_only_nodes and tiers set by hand are kept. Returns a ChangeReport.
+
+        """
+        self._update_meshes()
+        self._update_tiers()
+        self.timestamp = new_net.timestamp
+        self.domains_dict = new_net.domains_dict
+        report = ChangeReport()
+        dirty_nodes = set()
+
+        for node_id, node in new_net.nodes_dict.items():
+            old_node = self.nodes_dict.get(node_id)
+            if old_node is None:
+                report.nodes_added.add(node_id)
+                dirty_nodes.add(node_id)
+                if node.is_online:
+                    report.nodes_online.add(node_id)
+            elif not old_node.same_fields(node):
+                report.nodes_changed.add(node_id)
+                dirty_nodes.add(node_id)
+                if node.is_online and not old_node.is_online:
+                    report.nodes_online.add(node_id)
+                elif old_node.is_online and not node.is_online:
+                    report.nodes_offline.add(node_id)
+            if node.is_gateway and node.is_online and \
+                    (old_node is None or not (old_node.is_gateway and old_node.is_online)):
+                report.gateways_gained.add(node_id)
+            elif old_node is not None and old_node.is_gateway and old_node.is_online and \
+                    not (node.is_gateway and node.is_online):
+                report.gateways_lost.add(node_id)
+            self.nodes_dict[node_id] = node
+        for node_id in self.nodes_dict.keys() - new_net.nodes_dict.keys():
+            old_node = self.nodes_dict.pop(node_id)
+            report.nodes_removed.add(node_id)
+            if old_node.is_gateway and old_node.is_online:
+                report.gateways_lost.add(node_id)
+            dirty_nodes.add(node_id)
+
+        for link_id, link in new_net.links_dict.items():
+            old_link = self.links_dict.get(link_id)
+            if old_link is None:
+                report.links_added.add(link_id)
+            elif (old_link.vpn, old_link.tq, old_link.bidirect) != (link.vpn, link.tq, link.bidirect):
+                report.links_changed.add(link_id)
+            else:
+                continue
+            self._add_link(link)
+            dirty_nodes.update((link.source, link.target))
+        for link_id in self.links_dict.keys() - new_net.links_dict.keys():
+            link = self._remove_link(link_id)
+            report.links_removed.add(link_id)
+            dirty_nodes.update((link.source, link.target))
+
+        # Everything derived from the graph is outdated now, except for meshes and tiers which get repaired.
+        # The summaries of the meshes that were not touched stay valid as well.
+        meshes_vpn_only_nodes = self._meshes_vpn_only_nodes
+        tier_dict = self._tier_dict
+        mesh_summary_dict = self._mesh_summary_dict
+        self._invalidate()
+        self._meshes_vpn_only_nodes = meshes_vpn_only_nodes
+        self._tier_dict = tier_dict
+        self._mesh_summary_dict = mesh_summary_dict
+        report.mesh_splits, report.mesh_merges = self._repair_meshes(dirty_nodes)
+        report.tier_changes = self._repair_tiers(dirty_nodes)
+        self._drop_mesh_summaries({self._mesh_id_dict[node_id] for node_id in report.tier_changes
+                                   if node_id in self._mesh_id_dict})
+        return report
+
+    _snapshot_magic = b'NTKS'
+    _snapshot_version = 2
+    # magic, format version, number of strings, node_ids, nodes, links, vpn_only_nodes, tier seeds, timestamp string
+    _snapshot_header = struct.Struct('<4sHxxIIIIIIi')
+
+    @_instrumented('save')
+    def save(self, file):
+        """
+        Write the Network to a compact binary snapshot that Network.load() can read back quickly.
+
+        file is a path or a binary file object. The snapshot contains the nodes, links, vpn_only_nodes, tiers set by
+        hand and the computed tiers and meshes, but not the raw JSON of the nodes. Node ids are stored once in a
+        string table and everything else as little-endian integer and float columns.
+
+        """
+        if not hasattr(file, 'write'):
+            with open(file, 'wb') as f:
+                return self.save(f)
+
+        self._update_meshes()
+        self._update_tiers()
+        strings = list(self.nodes_dict)
+        strings.extend(node_id for node_id in self.adjacency_dict if node_id not in self.nodes_dict)
+        node_id_count = len(strings)
+        string_index_dict = {string: i for i, string in enumerate(strings)}
+
+        def string_index(string):
+            if string is None:
+                return -1
+            if string not in string_index_dict:
+                string_index_dict[string] = len(strings)
+                strings.append(string)
+            return string_index_dict[string]
+
+        nodes = self.nodes_dict.values()
+        node_flags = array.array('B', (node.is_gateway | node.is_online << 1 | (node.location is not None) << 2
+                                       for node in nodes))
+        client_counts = array.array('i', (-1 if node.client_count is None else node.client_count for node in nodes))
+        hostnames = array.array('i', (string_index(node.hostname) for node in nodes))
+        ipv6s = array.array('i', (string_index(node.ipv6) for node in nodes))
+        releases = array.array('i', (string_index(node.release) for node in nodes))
+        latitudes = array.array('d', (node.location[0] if node.location else 0.0 for node in nodes))
+        longitudes = array.array('d', (node.location[1] if node.location else 0.0 for node in nodes))
+
+        links = self.links_dict.values()
+        sources = array.array('I', (string_index_dict[link.source] for link in links))
+        targets = array.array('I', (string_index_dict[link.target] for link in links))
+        tqs = array.array('d', (link.tq for link in links))
+        link_flags = array.array('B', (link.vpn | link.bidirect << 1 for link in links))
+
+        vpn_only_nodes = array.array('i', (string_index(node_id) for node_id in self.vpn_only_nodes))
+        seed_nodes = array.array('i', (string_index(node_id) for node_id in self._tier_seeds_dict))
+        seed_tiers = array.array('i', self._tier_seeds_dict.values())
+        timestamp = string_index(self.timestamp)
+        tiers = array.array('i', (self._tier_dict.get(node_id, -1) for node_id in strings[:node_id_count]))
+        mesh_ids = array.array('i', (self._mesh_id_dict[node_id] for node_id in strings[:node_id_count]))
+
+        string_blob = '\0'.join(strings).encode()
+        file.write(self._snapshot_header.pack(self._snapshot_magic, self._snapshot_version, len(strings),
+                                              node_id_count, len(nodes), len(links), len(vpn_only_nodes),
+                                              len(seed_nodes), timestamp))
+        file.write(struct.pack('<Q', len(string_blob)))
+        for column in (string_blob, latitudes, longitudes, tqs, client_counts, hostnames, ipv6s, releases, sources,
+                       targets, vpn_only_nodes, seed_nodes, seed_tiers, tiers, mesh_ids, node_flags, link_flags):
+            if isinstance(column, array.array) and sys.byteorder != 'little':
+                column = array.array(column.typecode, column)
+                column.byteswap()
+            file.write(column)
+            # Keep every column 8 byte aligned, so it can be used in place.
+            file.write(b'\0' * (-len(memoryview(column).cast('B')) % 8))
+
+    @classmethod
+    def load(cls, file, instrumentation=None):
+        """
+        Read a Network from a binary snapshot written by Network.save(). file is a path or binary file object.
+
+        The loading is timed with instrumentation, which becomes the Instrumentation of the new Network.
+
+        """
+        if not hasattr(file, 'read'):
+            with open(file, 'rb') as f:
+                return cls.load(f, instrumentation)
         try:
-            return Version(self.json['nodeinfo']['software']['firmware']['release'])
-        except KeyError:
-            pass
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            buffer = file.read()
+        try:
+            with _phase(instrumentation, 'load'), memoryview(buffer) as view:
+                net = cls._load_buffer(view)
+        finally:
+            if isinstance(buffer, mmap.mmap) and not buffer.closed:
+                buffer.close()
+        net.instrumentation = instrumentation
+        return net
 
-    @property
-    def client_count(self):
-        return self.json["statistics"]["clients"]
+    @classmethod
+    def _load_buffer(cls, buffer):
+        # The columns are views into buffer. They are all released here, even if the snapshot turns out to be broken
+        # and the traceback still refers to them, so that an mmap under buffer can be closed.
+        views = []
+        try:
+            return cls._load_views(buffer, views)
+        except (IndexError, KeyError, TypeError, struct.error) as e:
+            raise ValueError("Broken snapshot") from e
+        finally:
+            for view in reversed(views):
+                view.release()
 
-    @property
-    def hostname(self):
-        return self.json["nodeinfo"]["hostname"]
+    @classmethod
+    def _load_views(cls, buffer, views):
+        if len(buffer) < cls._snapshot_header.size + 8:
+            raise ValueError("Truncated snapshot")
+        magic, version, string_count, node_id_count, node_count, link_count, vpn_only_count, seed_count, \
+            timestamp = cls._snapshot_header.unpack_from(buffer)
+        if magic != cls._snapshot_magic or version != cls._snapshot_version:
+            raise ValueError("Not a nodesTk snapshot of version {}".format(cls._snapshot_version))
+        offset = cls._snapshot_header.size
+        string_blob_length, = struct.unpack_from('<Q', buffer, offset)
+        offset += 8
+
+        def column(typecode, count):
+            nonlocal offset
+            size = array.array(typecode).itemsize * count
+            if offset + size > len(buffer):
+                raise ValueError("Truncated snapshot")
+            view = buffer[offset:offset + size]
+            views.append(view)
+            offset += size + (-size % 8)
+            if sys.byteorder != 'little':
+                values = array.array(typecode, view.tobytes())
+                values.byteswap()
+                return values
+            values = view.cast(typecode)
+            views.append(values)
+            return values
+
+        strings = column('B', string_blob_length).tobytes().decode().split('\0') if string_count else []
+        if len(strings) != string_count:
+            raise ValueError("Broken string table in snapshot")
+        latitudes = column('d', node_count)
+        longitudes = column('d', node_count)
+        tqs = column('d', link_count)
+        client_counts = column('i', node_count)
+        hostnames = column('i', node_count)
+        ipv6s = column('i', node_count)
+        releases = column('i', node_count)
+        sources = column('I', link_count)
+        targets = column('I', link_count)
+        vpn_only_nodes = column('i', vpn_only_count)
+        seed_nodes = column('i', seed_count)
+        seed_tiers = column('i', seed_count)
+        tiers = column('i', node_id_count)
+        mesh_ids = column('i', node_id_count)
+        node_flags = column('B', node_count)
+        link_flags = column('B', link_count)
+
+        strings.append(None)  # index -1 is a missing string
+        net = cls()
+        net.timestamp = strings[timestamp]
+        for i in range(node_count):
+            flags = node_flags[i]
+            net.nodes_dict[strings[i]] = Node.from_fields(
+                node_id=strings[i], is_gateway=bool(flags & 1), is_online=bool(flags & 2),
+                client_count=None if client_counts[i] < 0 else client_counts[i], hostname=strings[hostnames[i]],
+                ipv6=strings[ipv6s[i]], location=(latitudes[i], longitudes[i]) if flags & 4 else None,
+                release=strings[releases[i]])
+        for i in range(link_count):
+            flags = link_flags[i]
+            net._add_link(Link(strings[sources[i]], strings[targets[i]], bool(flags & 1), tqs[i], bool(flags & 2)))
+        net.vpn_only_nodes.update(strings[i] for i in vpn_only_nodes)
+        net._tier_seeds_dict.update((strings[node], tier) for node, tier in zip(seed_nodes, seed_tiers))
+
+        # Install the tiers and meshes that were computed before saving.
+        tier_dict = net._tier_dict = dict()
+        for i in range(node_id_count):
+            if tiers[i] >= 0:
+                tier_dict[strings[i]] = tiers[i]
+                net._tiers_dict.setdefault(tiers[i], set()).add(strings[i])
+        net._tiers_dict = {tier: frozenset(nodes) for tier, nodes in net._tiers_dict.items()}
+        mesh_nodes_dict = dict()
+        for i in range(node_id_count):
+            net._mesh_id_dict[strings[i]] = mesh_ids[i]
+            mesh_nodes_dict.setdefault(mesh_ids[i], []).append(strings[i])
+        net._meshes_dict = {mesh_id: frozenset(nodes) for mesh_id, nodes in mesh_nodes_dict.items()}
+        fake_meshes_dict = {mesh_id: set() for mesh_id in net._meshes_dict}
+        for link in net.links_dict.values():
+            if not link.vpn and (link.source in net.vpn_only_nodes or link.target in net.vpn_only_nodes):
+                connection = frozenset((link.source, link.target))
+                fake_meshes_dict[net._mesh_id_dict[link.source]].add(connection)
+                fake_meshes_dict[net._mesh_id_dict[link.target]].add(connection)
+        net._fake_meshes_dict = {mesh_id: frozenset(fakes) for mesh_id, fakes in fake_meshes_dict.items()}
+        net._online_meshes_set = frozenset(net._meshes_dict[net._mesh_id_dict[node_id]]
+                                           for node_id, node in net.nodes_dict.items() if node.is_online)
+        net._next_mesh_id = max(net._meshes_dict, default=-1) + 1
+        net._meshes_vpn_only_nodes = frozenset(net.vpn_only_nodes)
+        return net
+
+
+EARTH_RADIUS = 6371008.8  # mean radius in metres
+METRES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def get_distance(location, other_location):
+    """Return the great-circle distance in metres between two (latitude, longitude) tuples."""
+    latitude, longitude = map(math.radians, location)
+    other_latitude, other_longitude = map(math.radians, other_location)
+    a = (math.sin((other_latitude - latitude) / 2) ** 2 +
+         math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """
+    A grid over latitude and longitude to find nodes by their location.
+
+    Takes an iterable of (node_id, location) tuples, nodes without a location are skipped. cell_size is the edge
+    length of a grid cell in degrees. Distances are in metres.
+
+    """
+
+    def __init__(self, locations, cell_size=0.01):
+        self.cell_size = cell_size
+        self.cells_dict = dict()  # (row, column) as key and list of (node_id, location) as value
+        self.locations_dict = dict()  # node_id as key and location as value
+        for node_id, location in locations:
+            if location is None:
+                continue
+            self.locations_dict[node_id] = location
+            self.cells_dict.setdefault(self._cell(location), []).append((node_id, location))
+
+    def _cell(self, location):
+        return int(math.floor(location[0] / self.cell_size)), int(math.floor(location[1] / self.cell_size))
+
+    def _cells_in_range(self, min_row, max_row, min_column, max_column):
+        """Yield the entries of all cells in the given rows and columns."""
+        if (max_row - min_row + 1) * (max_column - min_column + 1) > len(self.cells_dict):
+            # Most of the range is empty, so looking at the occupied cells is faster.
+            for (row, column), entries in self.cells_dict.items():
+                if min_row <= row <= max_row and min_column <= column <= max_column:
+                    yield from entries
+            return
+        for row in range(min_row, max_row + 1):
+            for column in range(min_column, max_column + 1):
+                yield from self.cells_dict.get((row, column), ())
+
+    def _cells_around(self, location, metres):
+        """Yield the entries of all cells that can contain points within metres of location."""
+        row, column = self._cell(location)
+        row_span = int(math.ceil(metres / METRES_PER_DEGREE / self.cell_size))
+        latitude = min(89.0, abs(location[0]) + row_span * self.cell_size)
+        column_span = int(math.ceil(metres / (METRES_PER_DEGREE * math.cos(math.radians(latitude))) / self.cell_size))
+        return self._cells_in_range(row - row_span, row + row_span, column - column_span, column + column_span)
+
+    def _min_distance(self, location, cell):
+        """Return a lower bound of the distance in metres from location to any point in cell."""
+        latitude, longitude = location
+        min_latitude, min_longitude = cell[0] * self.cell_size, cell[1] * self.cell_size
+        max_latitude, max_longitude = min_latitude + self.cell_size, min_longitude + self.cell_size
+        latitude_gap = max(0.0, min_latitude - latitude, latitude - max_latitude)
+        longitude_gap = max(0.0, min_longitude - longitude, longitude - max_longitude) % 360
+        longitude_gap = min(longitude_gap, 360 - longitude_gap)
+        # The haversine formula of get_distance() with every term at its smallest within the cell.
+        cos_cell_latitude = max(0.0, math.cos(math.radians(max(abs(min_latitude), abs(max_latitude)))))
+        a = (math.sin(math.radians(latitude_gap) / 2) ** 2 +
+             math.cos(math.radians(latitude)) * cos_cell_latitude * math.sin(math.radians(longitude_gap) / 2) ** 2)
+        return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+    def within_radius(self, location, metres):
+        """Return a list of (node_id, distance) for all nodes within metres of location, nearest first."""
+        result = []
+        for node_id, node_location in self._cells_around(location, metres):
+            distance = get_distance(location, node_location)
+            if distance <= metres:
+                result.append((node_id, distance))
+        result.sort(key=lambda entry: entry[1])
+        return result
+
+    def within_bbox(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """Return a list of the node_ids of all nodes inside the bounding box."""
+        min_row, min_column = self._cell((min_latitude, min_longitude))
+        max_row, max_column = self._cell((max_latitude, max_longitude))
+        return [node_id for node_id, (latitude, longitude) in
+                self._cells_in_range(min_row, max_row, min_column, max_column)
+                if min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude]
+
+    def nearest(self, location, k=1):
+        """Return a list of (node_id, distance) of the k nearest nodes to location, nearest first."""
+        if not self.cells_dict:
+            return []
+        row, column = self._cell(location)
+        max_ring = max(max(abs(cell[0] - row), abs(cell[1] - column)) for cell in self.cells_dict)
+        candidates = []
+        for ring in range(max_ring + 1):
+            if (2 * ring + 1) ** 2 > len(self.cells_dict):
+                # The rings would cover more cells than are occupied, so the occupied cells that are left are looked
+                # at instead, nearest possible distance first.
+                cells = sorted((self._min_distance(location, cell), cell) for cell in self.cells_dict
+                               if max(abs(cell[0] - row), abs(cell[1] - column)) >= ring)
+                for bound, cell in cells:
+                    if len(candidates) == k and candidates[-1][1] <= bound:
+                        break
+                    candidates.extend((node_id, get_distance(location, node_location))
+                                      for node_id, node_location in self.cells_dict[cell])
+                    candidates.sort(key=lambda entry: entry[1])
+                    del candidates[k:]
+                break
+            for cell_row in range(row - ring, row + ring + 1):
+                step = 1 if ring == 0 or abs(cell_row - row) == ring else 2 * ring
+                for cell_column in range(column - ring, column + ring + 1, step):
+                    for node_id, node_location in self.cells_dict.get((cell_row, cell_column), ()):
+                        candidates.append((node_id, get_distance(location, node_location)))
+            candidates.sort(key=lambda entry: entry[1])
+            del candidates[k:]
+            # Everything outside of this ring is at least this far away.
+            latitude = min(89.0, abs(location[0]) + (ring + 1) * self.cell_size)
+            bound = ring * self.cell_size * METRES_PER_DEGREE * math.cos(math.radians(latitude))
+            if len(candidates) == k and candidates[-1][1] <= bound:
+                break
+        return candidates
+
+    def close_pairs(self, metres):
+        """Return a list of (node_id, node_id, distance) for all pairs of nodes within metres of each other."""
+        result = []
+        for node_id, location in self.locations_dict.items():
+            for other_node_id, distance in self.within_radius(location, metres):
+                if node_id < other_node_id:
+                    result.append((node_id, other_node_id, distance))
+        return result
+
+
+class SparseGraph:
+    """
+    A Network as integer-indexed CSR adjacency matrices for vectorized analytics with NumPy and SciPy.
+
+    node_ids maps the matrix indices to node_ids, index_dict the other way round. tq_matrix holds the tq of every
+    link (in both directions) and vpn_matrix the same links with True for VPN links. Fake mesh connections of
+    vpn_only_nodes count as VPN links and links of a node to itself are left out. The Network methods are the
+    pure-Python fallback for all of this.
+
+    """
+
+    def __init__(self, net):
+        import numpy
+        import scipy.sparse
+        self._numpy = numpy
+
+        self.node_ids = list(net.nodes_dict)
+        self.node_ids.extend(node_id for node_id in net.adjacency_dict if node_id not in net.nodes_dict)
+        self.index_dict = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        size = len(self.node_ids)
+
+        links = [link for link in net.links_dict.values() if link.source != link.target]
+        sources = numpy.fromiter((self.index_dict[link.source] for link in links), numpy.int64, len(links))
+        targets = numpy.fromiter((self.index_dict[link.target] for link in links), numpy.int64, len(links))
+        tqs = numpy.fromiter((link.tq for link in links), numpy.float64, len(links))
+        vpn = numpy.fromiter((link.vpn or link.source in net.vpn_only_nodes or link.target in net.vpn_only_nodes
+                              for link in links), numpy.bool_, len(links))
+
+        rows = numpy.concatenate((sources, targets))
+        columns = numpy.concatenate((targets, sources))
+        self.tq_matrix = scipy.sparse.csr_matrix((numpy.concatenate((tqs, tqs)), (rows, columns)), shape=(size, size))
+        self.vpn_matrix = scipy.sparse.csr_matrix((numpy.concatenate((vpn, vpn)), (rows, columns)),
+                                                  shape=(size, size), dtype=numpy.bool_)
+        mesh = ~vpn
+        self.mesh_matrix = scipy.sparse.csr_matrix(
+            (numpy.ones(2 * int(mesh.sum()), numpy.int8),
+             (numpy.concatenate((sources[mesh], targets[mesh])), numpy.concatenate((targets[mesh], sources[mesh])))),
+            shape=(size, size))
+        self.gateway_mask = numpy.zeros(size, numpy.bool_)
+        self.online_mask = numpy.zeros(size, numpy.bool_)
+        for i, node in enumerate(net.nodes_dict.values()):
+            self.gateway_mask[i] = node.is_gateway
+            self.online_mask[i] = node.is_online
+
+    def _to_dict(self, values, skip=None):
+        return {self.node_ids[i]: value for i, value in enumerate(values.tolist()) if value != skip}
+
+    def tiers(self):
+        """Return an array with the tier of every node, -1 for nodes without a connection to a gateway."""
+        import scipy.sparse.csgraph
+        numpy = self._numpy
+        gateways = numpy.flatnonzero(self.gateway_mask)
+        if not len(gateways):
+            return numpy.full(len(self.node_ids), -1, numpy.int64)
+        distances = scipy.sparse.csgraph.dijkstra(self.tq_matrix, directed=False, indices=gateways, unweighted=True,
+                                                  min_only=True)
+        return numpy.where(numpy.isinf(distances), -1, distances).astype(numpy.int64)
+
+    def tier_dict(self):
+        """Return a dict with the node_id as key and the tier as value, like Network.get_tier_of_node()."""
+        return self._to_dict(self.tiers(), skip=-1)
+
+    def uplink_qualities(self):
+        """Return an array with the quality of the best path to a gateway for every node, 0 without one."""
+        import scipy.sparse.csgraph
+        numpy = self._numpy
+        gateways = numpy.flatnonzero(self.gateway_mask)
+        if not len(gateways):
+            return numpy.zeros(len(self.node_ids))
+        costs = self.tq_matrix.copy()
+        costs.data = numpy.log(numpy.maximum(costs.data, 1.0))
+        return numpy.exp(-scipy.sparse.csgraph.dijkstra(costs, directed=False, indices=gateways, min_only=True))
+
+    def mesh_labels(self):
+        """Return the number of meshes and an array with the mesh label of every node."""
+        import scipy.sparse.csgraph
+        return scipy.sparse.csgraph.connected_components(self.mesh_matrix, directed=False)
+
+    def meshes(self):
+        """Return a frozenset of all meshes with at least one online node, like Network.get_meshes()."""
+        numpy = self._numpy
+        _, labels = self.mesh_labels()
+        order = numpy.argsort(labels, kind='stable')
+        boundaries = numpy.flatnonzero(numpy.diff(labels[order])) + 1
+        online_labels = set(labels[self.online_mask].tolist())
+        return frozenset(frozenset(self.node_ids[i] for i in group.tolist())
+                         for group in numpy.split(order, boundaries)
+                         if len(group) and labels[group[0]] in online_labels)
+
+    def degrees(self, vpn_neighbours=True):
+        """Return an array with the number of neighbours of every node, only mesh neighbours if not vpn_neighbours."""
+        matrix = self.tq_matrix if vpn_neighbours else self.mesh_matrix
+        return self._numpy.diff(matrix.indptr)
+
+    def degree_histogram(self, vpn_neighbours=True):
+        """Return an array with the number of nodes with each degree."""
+        return self._numpy.bincount(self.degrees(vpn_neighbours))
+
+    def reachable_from(self, node_id, vpn_neighbours=True):
+        """Return a set of all node_ids that can be reached from the node."""
+        import scipy.sparse.csgraph
+        matrix = self.tq_matrix if vpn_neighbours else self.mesh_matrix
+        order = scipy.sparse.csgraph.breadth_first_order(matrix, self.index_dict[node_id], directed=False,
+                                                         return_predecessors=False)
+        return {self.node_ids[i] for i in order.tolist()}
+
+
+class ChangeReport:
+    """
+    Describe what changed between two snapshots of a Network, see Network.update().
+
+    Nodes are given by node_id and links by link id. nodes_changed contains all nodes whose fields changed, including
+    those that went online or offline. nodes_online also contains the new nodes that are online. gateways_lost and
+    gateways_gained contain the gateways that stopped or started to be online gateways. tier_changes is a dict with
+    the node_id as key and a tuple of old and new tier as value, where a tier of None means no connection to a
+    gateway. mesh_splits contains a tuple of the old mesh and a frozenset of its parts for every mesh that fell apart,
+    and mesh_merges a tuple of a frozenset of the old meshes and the new mesh for every mesh that several meshes grew
+    together into.
+
+    """
+
+    def __init__(self):
+        self.nodes_added = set()
+        self.nodes_removed = set()
+        self.nodes_changed = set()
+        self.nodes_online = set()
+        self.nodes_offline = set()
+        self.gateways_lost = set()
+        self.gateways_gained = set()
+        self.links_added = set()
+        self.links_removed = set()
+        self.links_changed = set()
+        self.tier_changes = dict()
+        self.mesh_splits = set()
+        self.mesh_merges = set()
+
+    def __bool__(self):
+        return any((self.nodes_added, self.nodes_removed, self.nodes_changed, self.links_added, self.links_removed,
+                    self.links_changed, self.tier_changes))
+
+
+class MeshSummary:
+    """
+    Aggregate statistics of a mesh, see Network.get_mesh_summaries().
+
+    node_count, online_count, gateway_count and client_count (of the online nodes) count the nodes, release_counts
+    is a dict with the firmware release (None if unknown) as key and the number of nodes as value. min_tier and
+    max_tier give the distance to the gateways, None if no node has one. link_count, min_link_quality and
+    mean_link_quality describe the mesh links inside the mesh, by tq_percent. A summary made by combine() covers
+    mesh_count meshes and has neither a mesh_id nor node_ids.
+
+    """
+
+    __slots__ = ('mesh_id', 'node_ids', 'mesh_count', 'node_count', 'online_count', 'gateway_count', 'client_count',
+                 'release_counts', 'min_tier', 'max_tier', 'link_count', 'min_link_quality', '_link_quality_sum')
+
+    def __init__(self, mesh_id=None, node_ids=None):
+        self.mesh_id = mesh_id
+        self.node_ids = node_ids
+        self.mesh_count = 1
+        self.node_count = 0
+        self.online_count = 0
+        self.gateway_count = 0
+        self.client_count = 0
+        self.release_counts = dict()
+        self.min_tier = None
+        self.max_tier = None
+        self.link_count = 0
+        self.min_link_quality = None
+        self._link_quality_sum = 0.0
 
     @property
-    def ipv6(self):
-        """Return the ipv6 under which the device is reachable from the client network."""
-        return self.json['nodeinfo']['network']['addresses'][0]
+    def online_ratio(self):
+        return self.online_count / self.node_count if self.node_count else 0.0
 
     @property
-    def location(self) -> Union[tuple, None]:
-        """Return a tupel of latitude and longitude, if present."""
+    def mean_link_quality(self):
+        return self._link_quality_sum / self.link_count if self.link_count else None
+
+    @classmethod
+    def combine(cls, summaries):
+        """Return a MeshSummary over all nodes and links of summaries."""
+        combined = cls()
+        combined.mesh_count = 0
+        for summary in summaries:
+            combined.mesh_count += summary.mesh_count
+            combined.node_count += summary.node_count
+            combined.online_count += summary.online_count
+            combined.gateway_count += summary.gateway_count
+            combined.client_count += summary.client_count
+            for release, count in summary.release_counts.items():
+                combined.release_counts[release] = combined.release_counts.get(release, 0) + count
+            if summary.min_tier is not None:
+                combined.min_tier = summary.min_tier if combined.min_tier is None else \
+                    min(combined.min_tier, summary.min_tier)
+                combined.max_tier = max(combined.max_tier, summary.max_tier) if combined.max_tier is not None else \
+                    summary.max_tier
+            if summary.link_count:
+                combined.min_link_quality = summary.min_link_quality if combined.link_count == 0 else \
+                    min(combined.min_link_quality, summary.min_link_quality)
+                combined.link_count += summary.link_count
+                combined._link_quality_sum += summary._link_quality_sum
+        return combined
+
+    def __repr__(self):
+        return "MeshSummary(mesh_id={!r}, node_count={}, online_count={}, client_count={})".format(
+            self.mesh_id, self.node_count, self.online_count, self.client_count)
+
+
+class Node:
+    """
+    Represent a node of the nodes.json.
+
+    The fields that are used are extracted once: node_id, is_gateway, is_online, client_count, hostname, ipv6 (the
+    address under which the device is reachable from the client network) and location (a tupel of latitude and
+    longitude). Fields that are missing in the nodes.json are None. The raw JSON is only kept in json if keep_json is
+    set, otherwise json is None.
+
+    """
+
+    FIELDS = ('node_id', 'is_gateway', 'is_online', 'client_count', 'hostname', 'ipv6', 'location', 'release')
+    __slots__ = FIELDS + ('json', 'mesh_neighbours_set', 'vpn_neighbours_set')
+
+    def __init__(self, json_representation, keep_json=False):
+        nodeinfo = json_representation['nodeinfo']
+        flags = json_representation['flags']
+        self.node_id = sys.intern(nodeinfo['node_id'])
+        self.is_gateway = flags['gateway']
+        self.is_online = flags['online']
+        self.client_count = json_representation.get('statistics', {}).get('clients')
+        self.hostname = nodeinfo.get('hostname')
+        try:
+            self.ipv6 = nodeinfo['network']['addresses'][0]
+        except (KeyError, IndexError):
+            self.ipv6 = None
         try:
-            buffer = self.json['nodeinfo']['location']
-            coordinate = (buffer['latitude'], buffer['longitude'])
-            return coordinate
+            self.location = (nodeinfo['location']['latitude'], nodeinfo['location']['longitude'])
         except KeyError:
-            pass
+            self.location = None
+        try:
+            self.release = sys.intern(nodeinfo['software']['firmware']['release'])
+        except KeyError:
+            self.release = None
+        self.json = json_representation if keep_json else None
+        self.mesh_neighbours_set = None
+        self.vpn_neighbours_set = None
 
+    @classmethod
+    def from_fields(cls, **fields):
+        """Create a Node without JSON from the values of all FIELDS given as keyword arguments."""
+        node = cls.__new__(cls)
+        for field in cls.FIELDS:
+            setattr(node, field, fields[field])
+        node.json = None
+        node.mesh_neighbours_set = None
+        node.vpn_neighbours_set = None
+        return node
 
+    def same_fields(self, other):
+        """Return whether the extracted fields of both nodes are equal."""
+        return all(getattr(self, field) == getattr(other, field) for field in self.FIELDS)
+
+    @property
+    def version(self):
+        if self.release is not None:
+            return Version(self.release)
+
+
+@functools.total_ordering
 class Version:
     """
     Represent a gluon-firmware version.
@@ -173,25 +1692,83 @@ class Version:
     This one should make it easier to compare and represent different versions of the gluon firmware.
     Later, it may be possible to even match features of different versions.
 
+    Versions are immutable and parsed only once: creating a Version for a version string that is already in use
+    returns the existing object. They are ordered by major, minor, build and builddate. Parts that can not be parsed
+    are None and sort first.
+
     """
 
-    def __init__(self, version_string):
-        self.version_string = version_string
+    _minor_re = re.compile(r"\.(\d*)")
+    _build_re = re.compile(r"([a-zA-Z]*)-")
+    _instances = dict()  # version string as key and Version obj as value
+
+    __slots__ = ('version_string', '_major', '_minor', '_build', '_builddate', '_key')
+
+    def __new__(cls, version_string):
+        version = cls._instances.get(version_string)
+        if version is not None:
+            return version
+
+        version = object.__new__(cls)
+        major = version_string.split(".")[0]
+        minor = cls._minor_re.search(version_string)
+        minor = minor.group(1) if minor else None
+        build = cls._build_re.search(version_string)
+        build = build.group(1) if build else None
+        try:
+            builddate = datetime.datetime.strptime(version_string[-8:], "%Y%m%d").date()
+        except ValueError:
+            builddate = None
+        key = (int(major) if major.isdigit() else -1,
+               int(minor) if minor else -1,
+               build or "",
+               builddate or datetime.date.min,
+               version_string)
+        for name, value in (('version_string', version_string), ('_major', major), ('_minor', minor),
+                            ('_build', build), ('_builddate', builddate), ('_key', key)):
+            object.__setattr__(version, name, value)
+        cls._instances[version_string] = version
+        return version
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Version objects are immutable")
+
+    def __reduce__(self):
+        return Version, (self.version_string,)
+
+    def __repr__(self):
+        return "Version({!r})".format(self.version_string)
+
+    def __str__(self):
+        return self.version_string
+
+    def __hash__(self):
+        return hash(self.version_string)
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self.version_string == other.version_string
+
+    def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key < other._key
 
     @property
     def major(self):
         """Return the major-part of the version."""
-        return self.version_string.split(".")[0]
+        return self._major
 
     @property
     def minor(self):
         """Return the minor-part of the version."""
-        return re.findall(r"\.(\d*)", self.version_string)[0]
+        return self._minor
 
     @property
     def build(self):
         """Return the build-character(s) of the version."""
-        return re.findall(r"([a-zA-Z]*)-", self.version_string)[0]
+        return self._build
 
     @property
     def builddate(self):
@@ -201,7 +1778,7 @@ class Version:
         Returns a datetime.datetime.date object, so the precision is limited to days.
 
         """
-        return datetime.datetime.strptime(self.version_string[-8:], "%Y%m%d").date()
+        return self._builddate
 
 
 class Link:
@@ -217,48 +1794,1086 @@ class Link:
         return 1/self.tq
 
 
-def generate_from_file_objects(nodes_json_file, graph_json_file):
+class _JSONStreamReader:
+    """
+    Walk a JSON document from a file object while keeping only a small part of it in memory.
+
+    handlers is a dict with a tuple of object keys as key and a callable as value. If the value at such a path is an
+    array, the callable gets called with every item of it, otherwise it gets called once with the value.
+
+    """
+
+    _whitespace_re = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, file_obj, handlers, chunk_size=65536):
+        self.file_obj = file_obj
+        self.handlers = handlers
+        self.prefixes = {path[:i] for path in handlers for i in range(len(path))}
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.file_obj.read(self.chunk_size)
+        if isinstance(chunk, bytes):
+            chunk = self.utf8_decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            self.eof = True
+        # Drop everything that was already parsed.
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            self.pos = self._whitespace_re.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError("Unexpected end of JSON document")
+            self.fill()
+
+    def expect(self, characters):
+        character = self.peek()
+        if character not in characters:
+            raise ValueError("Expected one of {!r} but got {!r}".format(characters, character))
+        self.pos += 1
+        return character
+
+    def value(self):
+        """Decode the next complete value."""
+        while True:
+            self.peek()
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            if not self.eof and (end == len(self.buffer) or
+                                 (isinstance(obj, (int, float)) and self.buffer[end] in '.eE+-0123456789')):
+                # A number could continue in the next chunk.
+                self.fill()
+                continue
+            self.pos = end
+            return obj
+
+    def walk(self, path=()):
+        character = self.peek()
+        handler = self.handlers.get(path)
+        if character == '[':
+            self.pos += 1
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            while True:
+                if handler:
+                    handler(self.value())
+                else:
+                    self.walk(path + (None,))
+                if self.expect(',]') == ']':
+                    return
+        elif character == '{' and not handler:
+            self.pos += 1
+            if self.peek() == '}':
+                self.pos += 1
+                return
+            while True:
+                key = self.value()
+                self.expect(':')
+                self.walk(path + (key,) if path in self.prefixes else (None,))
+                if self.expect(',}') == '}':
+                    return
+        elif handler:
+            handler(self.value())
+        else:
+            self.value()
+
+
+def _generate_streaming(nodes_json_file, graph_json_file, keep_json, instrumentation):
     net = Network()
-    nodes_json = json.load(nodes_json_file)
-    for node in nodes_json['nodes']:
-        node_obj = Node(node)
-        net.add_node(node_obj)
+    with _phase(instrumentation, 'stream_nodes'):
+        _JSONStreamReader(nodes_json_file, {
+            ('timestamp',): lambda timestamp: setattr(net, 'timestamp', timestamp),
+            ('nodes',): lambda node: net.add_node(Node(node, keep_json)),
+        }).walk()
 
-    graph_json = json.load(graph_json_file)
     node_id_list = []
-    for node in graph_json['batadv']['nodes']:
-        node_id_list.append(node['node_id'])
-    for link in graph_json['batadv']['links']:
+    pending_links = []
+
+    def build_link(link):
         net.add_link(Link(node_id_list[link['source']],
                           node_id_list[link['target']],
                           link['vpn'],
                           link['tq'],
                           link['bidirect']))
+
+    def add_link(link):
+        if link['source'] < len(node_id_list) and link['target'] < len(node_id_list):
+            build_link(link)
+        else:
+            # The links came before the nodes, they have to wait until the node ids are known.
+            pending_links.append(link)
+
+    with _phase(instrumentation, 'stream_graph'):
+        _JSONStreamReader(graph_json_file, {
+            ('batadv', 'nodes'): lambda node: node_id_list.append(sys.intern(node['node_id'])),
+            ('batadv', 'links'): add_link,
+        }).walk()
+        # All node ids are known now, so a link that is still out of range raises IndexError like the other parser.
+        for link in pending_links:
+            build_link(link)
+    if instrumentation is not None:
+        instrumentation.count('nodes_parsed', len(net.nodes_dict))
+        instrumentation.count('links_parsed', len(net.links_dict))
+    net.instrumentation = instrumentation
     return net
 
 
-def generate_from_files(nodes_json_path, graph_json_path):
+def generate_from_file_objects(nodes_json_file, graph_json_file, streaming=False, keep_json=False,
+                               instrumentation=None):
+    """
+    Build a Network from file objects of a nodes.json and a graph.json.
+
+    With streaming=True the files are parsed item by item instead of loading the whole documents, which keeps the
+    peak memory usage low for big networks. With keep_json=True every Node keeps its raw JSON. The parsing is timed
+    with instrumentation, which becomes the Instrumentation of the new Network.
+
+    """
+    if streaming:
+        return _generate_streaming(nodes_json_file, graph_json_file, keep_json, instrumentation)
+
+    net = Network()
+    with _phase(instrumentation, 'parse_nodes_json'):
+        nodes_json = json.load(nodes_json_file)
+    with _phase(instrumentation, 'build_nodes'):
+        net.timestamp = nodes_json.get('timestamp')
+        for node in nodes_json['nodes']:
+            node_obj = Node(node, keep_json)
+            net.add_node(node_obj)
+
+    with _phase(instrumentation, 'parse_graph_json'):
+        graph_json = json.load(graph_json_file)
+    with _phase(instrumentation, 'build_links'):
+        node_id_list = []
+        for node in graph_json['batadv']['nodes']:
+            node_id_list.append(sys.intern(node['node_id']))
+        for link in graph_json['batadv']['links']:
+            net.add_link(Link(node_id_list[link['source']],
+                              node_id_list[link['target']],
+                              link['vpn'],
+                              link['tq'],
+                              link['bidirect']))
+    if instrumentation is not None:
+        instrumentation.count('nodes_parsed', len(nodes_json['nodes']))
+        instrumentation.count('links_parsed', len(graph_json['batadv']['links']))
+    net.instrumentation = instrumentation
+    return net
+
+
+def generate_from_files(nodes_json_path, graph_json_path, streaming=False, keep_json=False, instrumentation=None):
     with open(nodes_json_path, "r") as nodes_json:
         with open(graph_json_path, "r") as graph_json:
-            return generate_from_file_objects(nodes_json, graph_json)
+            return generate_from_file_objects(nodes_json, graph_json, streaming, keep_json, instrumentation)
+
+
+def _generate_domain(paths, streaming, keep_json):
+    """
+    Parse one domain for generate_from_domains() and return its timestamp, nodes and links as tuples.
 
+    The nodes are tuples of the values of Node.FIELDS and the JSON, the links tuples of link id, source, target, vpn,
+    tq and bidirect. These are much cheaper to send back from the worker process than the Network with its adjacency.
 
-def generate_from_urls(nodes_json_url, graph_json_url):
-    with urllib.request.urlopen(nodes_json_url) as nodes_json:
-        with urllib.request.urlopen(graph_json_url) as graph_json:
-            return generate_from_file_objects(nodes_json, graph_json)
+    """
+    net = generate_from_files(paths[0], paths[1], streaming, keep_json)
+    nodes = [tuple(getattr(node, field) for field in Node.FIELDS) + (node.json,) for node in net.nodes_dict.values()]
+    links = [(link_id, link.source, link.target, link.vpn, link.tq, link.bidirect)
+             for link_id, link in net.links_dict.items()]
+    return net.timestamp, nodes, links
 
 
-def main(nodes_json_path, graph_json_path):
-    net = generate_from_files(nodes_json_path, graph_json_path)
-    print(net.get_neighbours_of_node("a0f3c112e932", vpn_neighbours=False))
-    print(net.get_neighbours_of_node("a0f3c112e932", vpn_neighbours=True))
+def generate_from_domains(domains, streaming=False, keep_json=False, max_workers=None, instrumentation=None):
+    """
+    Build one Network from the nodes.json and graph.json of several batman domains.
 
+    domains maps each domain name to a tuple of the paths of its nodes.json and graph.json. The domains are parsed in
+    parallel in a pool of max_workers processes (default: one per CPU) and merged in the order of domains. The domains
+    of every node are kept in Network.domains_dict. A node that appears in more than one domain is taken from the
+    first domain in which it is online, or from the first domain if it is offline everywhere. A link that appears in
+    more than one domain is taken from the first one. The timestamp is the newest of all domains. Meshes and tiers
+    are computed over the merged network.
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument('nodesJSON')
-    parser.add_argument('graphJSON')
-    args = parser.parse_args()
+    """
+    import concurrent.futures
+    domains = list(domains.items())
+    with _phase(instrumentation, 'parse_domains'):
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            results = list(executor.map(_generate_domain, [paths for _, paths in domains],
+                                            itertools.repeat(streaming), itertools.repeat(keep_json)))
+
+    net = Network()
+    with _phase(instrumentation, 'merge_domains'):
+        domains_dict = dict()
+        online_index = Node.FIELDS.index('is_online')
+        for (domain, _), (timestamp, nodes, links) in zip(domains, results):
+            for fields in nodes:
+                node_id = sys.intern(fields[0])
+                domains_dict.setdefault(node_id, set()).add(domain)
+                old_node = net.nodes_dict.get(node_id)
+                if old_node is None or fields[online_index] and not old_node.is_online:
+                    node = Node.from_fields(**dict(zip(Node.FIELDS, fields)))
+                    node.node_id = node_id
+                    node.json = fields[-1]
+                    net.nodes_dict[node_id] = node
+            for link_id, source, target, vpn, tq, bidirect in links:
+                if link_id not in net.links_dict:
+                    net._add_link(Link(sys.intern(source), sys.intern(target), vpn, tq, bidirect), link_id)
+            if timestamp is not None and (net.timestamp is None or _to_epoch(timestamp) > _to_epoch(net.timestamp)):
+                net.timestamp = timestamp
+        net.domains_dict = {node_id: frozenset(domains) for node_id, domains in domains_dict.items()}
+    if instrumentation is not None:
+        instrumentation.count('domains_parsed', len(domains))
+        instrumentation.count('nodes_parsed', sum(len(nodes) for _, nodes, _ in results))
+        instrumentation.count('links_parsed', sum(len(links) for _, _, links in results))
+    net.instrumentation = instrumentation
+    return net
+
+
+def _is_url(location):
+    return re.match(r'[a-z][a-z0-9+.-]*://', location, re.IGNORECASE) is not None
+
+
+def _fetch_url(url, cache_dir=None, timeout=None):
+    """
+    Download url and return a binary file object with its content.
+
+    Asks for gzip transfer encoding. If cache_dir is given the content is stored there together with its ETag and
+    Last-Modified headers, and as long as the server answers the conditional request with 304 the stored copy is used.
+    Otherwise the content is spooled to an anonymous temporary file, so it is never held in memory as a whole.
+
+    """
+    import gzip
+    import hashlib
+    import shutil
+    import tempfile
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})
+    cache_path = meta_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, hashlib.sha256(url.encode()).hexdigest())
+        meta_path = cache_path + ".json"
+        try:
+            with open(meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            meta = {}
+        if os.path.exists(cache_path):
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cache_path is not None:
+            return open(cache_path, "rb")
+        raise
+
+    with response:
+        body = response
+        if response.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=response)
+        if cache_path is None:
+            spool_file = tempfile.TemporaryFile()
+            try:
+                shutil.copyfileobj(body, spool_file)
+                spool_file.seek(0)
+            except BaseException:
+                spool_file.close()
+                raise
+            return spool_file
+
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as cache_file:
+            try:
+                shutil.copyfileobj(body, cache_file)
+            except BaseException:
+                os.remove(cache_file.name)
+                raise
+        # Drop the old headers first, so they never get paired with the new content.
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        os.replace(cache_file.name, cache_path)
+        with open(meta_path, "w") as meta_file:
+            json.dump({'etag': response.headers.get('ETag'),
+                       'last_modified': response.headers.get('Last-Modified')}, meta_file)
+    return open(cache_path, "rb")
+
+
+def generate_from_urls(nodes_json_url, graph_json_url, streaming=False, keep_json=False, cache_dir=None,
+                       timeout=None, instrumentation=None):
+    """
+    Build a Network from the URLs of a nodes.json and a graph.json.
+
+    Both files are downloaded at the same time. If cache_dir is given, unchanged files are served from there, see
+    _fetch_url().
+
+    """
+    import concurrent.futures
+    with _phase(instrumentation, 'fetch'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(_fetch_url, url, cache_dir, timeout) for url in (nodes_json_url, graph_json_url)]
+    # Both downloads are finished here, so the file of one is not left open when the other failed.
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        for future in futures:
+            if future.exception() is None:
+                future.result().close()
+        raise errors[0]
+    nodes_json, graph_json = (future.result() for future in futures)
+    with nodes_json:
+        with graph_json:
+            return generate_from_file_objects(nodes_json, graph_json, streaming, keep_json, instrumentation)
+
+
+def _to_epoch(timestamp):
+    """
+    Return a timestamp string of the nodes.json, a datetime or a number as seconds since the epoch.
+
+    Timestamp strings may have fractional seconds, and the UTC offset may be written with a colon.
+
+    """
+    if isinstance(timestamp, str):
+        for timestamp_format in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S.%f%z"):
+            try:
+                timestamp = datetime.datetime.strptime(timestamp, timestamp_format)
+                break
+            except ValueError:
+                pass
+        else:
+            timestamp = datetime.datetime.fromisoformat(timestamp)
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+class HistoryStore:
+    """
+    Keep many snapshots of a network in a SQLite database.
+
+    Every ingested snapshot stores the state of each node and link, indexed by node_id or link id and timestamp, so
+    questions about the past can be answered without parsing the archived files again. Timestamps are returned as
+    seconds since the epoch and can be given as such, as datetime or as a timestamp string of the nodes.json.
+
+    """
+
+    NODE_FIELDS = ('online', 'gateway', 'clients', 'tier', 'release')
+
+    def __init__(self, path=":memory:"):
+        import sqlite3
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                timestamp REAL PRIMARY KEY, node_count INTEGER, link_count INTEGER);
+            CREATE TABLE IF NOT EXISTS node_states (
+                node_id TEXT, timestamp REAL, online INTEGER, gateway INTEGER, clients INTEGER, tier INTEGER,
+                release TEXT, PRIMARY KEY (node_id, timestamp)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS link_states (
+                link_id TEXT, timestamp REAL, vpn INTEGER, tq REAL, PRIMARY KEY (link_id, timestamp)) WITHOUT ROWID;
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def ingest(self, net, timestamp=None):
+        """Store the state of all nodes and links of net. The timestamp defaults to the one of the nodes.json."""
+        if timestamp is None:
+            timestamp = net.timestamp
+        if timestamp is None:
+            raise ValueError("The network has no timestamp, please pass one")
+        timestamp = _to_epoch(timestamp)
+        with self.connection:
+            # The state tables are keyed on the id first, so deleting by timestamp scans them. Only do that when a
+            # snapshot with this timestamp is replaced, which keeps the usual ingest independent of the archive size.
+            if self.connection.execute("SELECT 1 FROM snapshots WHERE timestamp = ?", (timestamp,)).fetchone():
+                for table in ('snapshots', 'node_states', 'link_states'):
+                    self.connection.execute("DELETE FROM {} WHERE timestamp = ?".format(table), (timestamp,))
+            self.connection.execute("INSERT INTO snapshots VALUES (?, ?, ?)",
+                                    (timestamp, len(net.nodes_dict), len(net.links_dict)))
+            self.connection.executemany(
+                "INSERT INTO node_states VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((node_id, timestamp, node.is_online, node.is_gateway, node.client_count,
+                  net.get_tier_of_node(node_id), node.release) for node_id, node in net.nodes_dict.items()))
+            self.connection.executemany(
+                "INSERT INTO link_states VALUES (?, ?, ?, ?)",
+                ((link_id, timestamp, link.vpn, link.tq) for link_id, link in net.links_dict.items()))
+
+    def ingest_files(self, nodes_json_path, graph_json_path, timestamp=None):
+        self.ingest(generate_from_files(nodes_json_path, graph_json_path, streaming=True), timestamp)
+
+    @staticmethod
+    def _range(start, end):
+        return (-float('inf') if start is None else _to_epoch(start),
+                float('inf') if end is None else _to_epoch(end))
+
+    def timestamps(self, start=None, end=None):
+        """Return a list of the timestamps of all snapshots between start and end (inclusive)."""
+        return [row[0] for row in self.connection.execute(
+            "SELECT timestamp FROM snapshots WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp",
+            self._range(start, end))]
+
+    def node_series(self, node_id, field, start=None, end=None):
+        """Return a list of (timestamp, value) tuples of one of NODE_FIELDS for all snapshots with the node."""
+        if field not in self.NODE_FIELDS:
+            raise ValueError("Unknown field {!r}, use one of {}".format(field, self.NODE_FIELDS))
+        return self.connection.execute(
+            "SELECT timestamp, {} FROM node_states WHERE node_id = ? AND timestamp BETWEEN ? AND ? "
+            "ORDER BY timestamp".format(field), (node_id,) + self._range(start, end)).fetchall()
+
+    def client_count_series(self, node_id, start=None, end=None):
+        return self.node_series(node_id, 'clients', start, end)
+
+    def uptime(self, node_id, start=None, end=None):
+        """Return the share of snapshots between start and end in which the node was online, or None without any."""
+        snapshot_count, = self.connection.execute(
+            "SELECT count(*) FROM snapshots WHERE timestamp BETWEEN ? AND ?", self._range(start, end)).fetchone()
+        if not snapshot_count:
+            return None
+        online_count, = self.connection.execute(
+            "SELECT count(*) FROM node_states WHERE node_id = ? AND timestamp BETWEEN ? AND ? AND online",
+            (node_id,) + self._range(start, end)).fetchone()
+        return online_count / snapshot_count
+
+    def link_disappearances(self, source, target, start=None, end=None):
+        """Return a list of the timestamps of all snapshots that lack the link although the one before had it."""
+        link_id = Network.get_link_id(source, target)
+        present = {row[0] for row in self.connection.execute(
+            "SELECT timestamp FROM link_states WHERE link_id = ? AND timestamp BETWEEN ? AND ?",
+            (link_id,) + self._range(start, end))}
+        disappearances = []
+        was_present = False
+        for timestamp in self.timestamps(start, end):
+            if was_present and timestamp not in present:
+                disappearances.append(timestamp)
+            was_present = timestamp in present
+        return disappearances
+
+
+def update_from_file_objects(net, nodes_json_file, graph_json_file, streaming=False, keep_json=False):
+    """Update net in place with a newer nodes.json and graph.json and return a ChangeReport, see Network.update()."""
+    return net.update(generate_from_file_objects(nodes_json_file, graph_json_file, streaming, keep_json,
+                                                 net.instrumentation))
+
+
+def update_from_files(net, nodes_json_path, graph_json_path, streaming=False, keep_json=False):
+    return net.update(generate_from_files(nodes_json_path, graph_json_path, streaming, keep_json, net.instrumentation))
+
+
+def update_from_urls(net, nodes_json_url, graph_json_url, streaming=False, keep_json=False, cache_dir=None,
+                     timeout=None):
+    return net.update(generate_from_urls(nodes_json_url, graph_json_url, streaming, keep_json, cache_dir, timeout,
+                                         net.instrumentation))
+
+
+# name and type (in GraphML terms) of the attributes the exporters write for every node and link
+_EXPORT_NODE_ATTRIBUTES = (('hostname', 'string'), ('online', 'boolean'), ('gateway', 'boolean'), ('clients', 'int'),
+                           ('release', 'string'), ('tier', 'int'), ('mesh', 'int'), ('latitude', 'double'),
+                           ('longitude', 'double'))
+_EXPORT_LINK_ATTRIBUTES = (('tq', 'double'), ('vpn', 'boolean'), ('bidirect', 'boolean'), ('fake_mesh', 'boolean'))
+
+
+def _export_nodes(net):
+    """
+    Yield the node_id and a dict of the attributes of every node, including nodes that are only known from links.
 
-    main(args.nodesJSON, args.graphJSON)
+    Attributes that are unknown are left out.
+
+    """
+    for node_id in sorted(net.nodes_dict.keys() | net.adjacency_dict.keys()):
+        node = net.nodes_dict.get(node_id)
+        attributes = {'tier': net.get_tier_of_node(node_id), 'mesh': net.get_mesh_id_of_node(node_id)}
+        if node is not None:
+            attributes.update(hostname=node.hostname, online=node.is_online, gateway=node.is_gateway,
+                              clients=node.client_count, release=node.release)
+            if node.location is not None:
+                attributes['latitude'], attributes['longitude'] = node.location
+        yield node_id, {name: value for name, value in attributes.items() if value is not None}
+
+
+def _export_links(net):
+    """Yield every link and a dict of its attributes."""
+    for link_id, link in sorted(net.links_dict.items()):
+        yield link, {'tq': link.tq, 'vpn': link.vpn, 'bidirect': link.bidirect,
+                     'fake_mesh': net.is_fake_mesh_link(link)}
+
+
+def _xml_escape(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def export_graphml(net, output):
+    """Write net as GraphML to the text file object output, element by element."""
+    output.write('<?xml version="1.0" encoding="UTF-8"?>\n<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    for kind, attributes in (('node', _EXPORT_NODE_ATTRIBUTES), ('edge', _EXPORT_LINK_ATTRIBUTES)):
+        for name, attribute_type in attributes:
+            output.write('  <key id="{0}" for="{1}" attr.name="{0}" attr.type="{2}"/>\n'.format(name, kind,
+                                                                                              attribute_type))
+    output.write('  <graph id="nodes" edgedefault="undirected">\n')
+    for node_id, attributes in _export_nodes(net):
+        output.write('    <node id="{}">'.format(_xml_escape(node_id)))
+        for name, value in attributes.items():
+            output.write('<data key="{}">{}</data>'.format(name, _xml_escape(value)))
+        output.write('</node>\n')
+    for link, attributes in _export_links(net):
+        output.write('    <edge source="{}" target="{}">'.format(_xml_escape(link.source), _xml_escape(link.target)))
+        for name, value in attributes.items():
+            output.write('<data key="{}">{}</data>'.format(name, _xml_escape(value)))
+        output.write('</edge>\n')
+    output.write('  </graph>\n</graphml>\n')
+
+
+def export_gexf(net, output):
+    """Write net as GEXF 1.2 to the text file object output, element by element. Edges are weighted by tq_percent."""
+    output.write('<?xml version="1.0" encoding="UTF-8"?>\n<gexf xmlns="http://gexf.net/1.2" version="1.2">\n'
+                 '  <graph mode="static" defaultedgetype="undirected">\n')
+    for kind, attributes in (('node', _EXPORT_NODE_ATTRIBUTES), ('edge', _EXPORT_LINK_ATTRIBUTES)):
+        output.write('    <attributes class="{}">\n'.format(kind))
+        for name, attribute_type in attributes:
+            output.write('      <attribute id="{0}" title="{0}" type="{1}"/>\n'.format(
+                name, 'integer' if attribute_type == 'int' else attribute_type))
+        output.write('    </attributes>\n')
+    output.write('    <nodes>\n')
+    for node_id, attributes in _export_nodes(net):
+        output.write('      <node id="{}" label="{}"><attvalues>'.format(
+            _xml_escape(node_id), _xml_escape(attributes.get('hostname', node_id))))
+        for name, value in attributes.items():
+            output.write('<attvalue for="{}" value="{}"/>'.format(name, _xml_escape(value)))
+        output.write('</attvalues></node>\n')
+    output.write('    </nodes>\n    <edges>\n')
+    for link, attributes in _export_links(net):
+        output.write('      <edge id="{}" source="{}" target="{}" weight="{}"><attvalues>'.format(
+            _xml_escape(Network.get_link_id(link.source, link.target)), _xml_escape(link.source),
+            _xml_escape(link.target), link.tq_percent))
+        for name, value in attributes.items():
+            output.write('<attvalue for="{}" value="{}"/>'.format(name, _xml_escape(value)))
+        output.write('</attvalues></edge>\n')
+    output.write('    </edges>\n  </graph>\n</gexf>\n')
+
+
+def _dot_quote(value):
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    return '"{}"'.format(str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+
+
+def export_dot(net, output):
+    """Write net as an undirected Graphviz DOT graph to the text file object output. VPN links are dashed."""
+    output.write('graph nodes {\n')
+    for node_id, attributes in _export_nodes(net):
+        attributes['label'] = attributes.get('hostname', node_id)
+        output.write('  {} [{}];\n'.format(_dot_quote(node_id), ", ".join(
+            "{}={}".format(name, _dot_quote(value)) for name, value in attributes.items())))
+    for link, attributes in _export_links(net):
+        if link.vpn:
+            attributes['style'] = 'dashed'
+        output.write('  {} -- {} [{}];\n'.format(_dot_quote(link.source), _dot_quote(link.target), ", ".join(
+            "{}={}".format(name, _dot_quote(value)) for name, value in attributes.items())))
+    output.write('}\n')
+
+
+def export_geojson(net, output):
+    """
+    Write net as a GeoJSON FeatureCollection to the text file object output, feature by feature.
+
+    Every node with a location becomes a Point and every link between two such nodes a LineString.
+
+    """
+    output.write('{"type": "FeatureCollection", "features": [')
+    separator = "\n"
+    for node_id, attributes in _export_nodes(net):
+        if 'latitude' not in attributes:
+            continue
+        attributes['node_id'] = node_id
+        output.write(separator)
+        output.write(json.dumps({'type': 'Feature', 'properties': attributes, 'geometry': {
+            'type': 'Point', 'coordinates': [attributes.pop('longitude'), attributes.pop('latitude')]}}))
+        separator = ",\n"
+    for link, attributes in _export_links(net):
+        source, target = net.nodes_dict.get(link.source), net.nodes_dict.get(link.target)
+        if source is None or target is None or source.location is None or target.location is None:
+            continue
+        attributes.update(source=link.source, target=link.target)
+        output.write(separator)
+        output.write(json.dumps({'type': 'Feature', 'properties': attributes, 'geometry': {
+            'type': 'LineString', 'coordinates': [[source.location[1], source.location[0]],
+                                                  [target.location[1], target.location[0]]]}}))
+        separator = ",\n"
+    output.write('\n]}\n')
+
+
+_EDGE_LIST_HEADER = ('source', 'target', 'tq', 'vpn', 'bidirect', 'fake_mesh')
+
+
+def export_edge_list(net, output):
+    """
+    Write the links of net as CSV to the text file object output, one line per link.
+
+    The columns are given by the header line: source, target, tq, then vpn, bidirect and fake_mesh as 1 or 0. The
+    file can be read back with import_edge_list().
+
+    """
+    import csv
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(_EDGE_LIST_HEADER)
+    for link, attributes in _export_links(net):
+        writer.writerow((link.source, link.target, repr(link.tq), int(link.vpn), int(link.bidirect),
+                         int(attributes['fake_mesh'])))
+
+
+def import_edge_list(file, net=None):
+    """
+    Read links written by export_edge_list() from the text file object file into net and return it.
+
+    Without net a new Network is created, which only has the links. Columns are found by the header line, the
+    fake_mesh column is ignored as it is derived from Network.vpn_only_nodes.
+
+    """
+    import csv
+    if net is None:
+        net = Network()
+    reader = csv.reader(file)
+    header = next(reader)
+    source_column, target_column, tq_column, vpn_column, bidirect_column = \
+        (header.index(name) for name in _EDGE_LIST_HEADER[:5])
+    intern = sys.intern
+    for row in reader:
+        if not row:
+            continue
+        net._add_link(Link(intern(row[source_column]), intern(row[target_column]), row[vpn_column] == '1',
+                           float(row[tq_column]), row[bidirect_column] == '1'))
+    net._invalidate()
+    return net
+
+
+class WatchEvent:
+    """A change that a Watcher found between two snapshots. The subclasses name their fields in FIELDS."""
+
+    FIELDS = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self.FIELDS, values):
+            setattr(self, field, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            all(getattr(self, field) == getattr(other, field) for field in self.FIELDS)
+
+    def __hash__(self):
+        return hash((type(self),) + tuple(getattr(self, field) for field in self.FIELDS))
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__,
+                               ", ".join(repr(getattr(self, field)) for field in self.FIELDS))
+
+
+class GatewayLost(WatchEvent):
+    FIELDS = ('node_id',)
+
+
+class NodeOffline(WatchEvent):
+    FIELDS = ('node_id',)
+
+
+class NodeOnline(WatchEvent):
+    FIELDS = ('node_id',)
+
+
+class NodeAdded(WatchEvent):
+    """The node is new in the snapshot. If it is online a NodeOnline is sent for it, too."""
+
+    FIELDS = ('node_id',)
+
+
+class NodeRemoved(WatchEvent):
+    """The node is not in the snapshot any more. No NodeOffline is sent for it."""
+
+    FIELDS = ('node_id',)
+
+
+class TierChanged(WatchEvent):
+    FIELDS = ('node_id', 'old_tier', 'new_tier')
+
+
+class MeshSplit(WatchEvent):
+    FIELDS = ('old_mesh', 'new_meshes')
+
+
+class MeshMerged(WatchEvent):
+    FIELDS = ('old_meshes', 'new_mesh')
+
+
+def get_events(report):
+    """Return the list of WatchEvents of a ChangeReport."""
+    events = [GatewayLost(node_id) for node_id in sorted(report.gateways_lost)]
+    events.extend(NodeOffline(node_id) for node_id in sorted(report.nodes_offline))
+    events.extend(NodeAdded(node_id) for node_id in sorted(report.nodes_added))
+    events.extend(NodeOnline(node_id) for node_id in sorted(report.nodes_online))
+    events.extend(NodeRemoved(node_id) for node_id in sorted(report.nodes_removed))
+    events.extend(MeshSplit(old_mesh, new_meshes) for old_mesh, new_meshes in report.mesh_splits)
+    events.extend(MeshMerged(old_meshes, new_mesh) for old_meshes, new_mesh in report.mesh_merges)
+    events.extend(TierChanged(node_id, old_tier, new_tier)
+                  for node_id, (old_tier, new_tier) in sorted(report.tier_changes.items()))
+    return events
+
+
+class Watcher:
+    """
+    Keep a Network up to date by polling a nodes.json and a graph.json and tell subscribers what changed.
+
+    The locations are URLs or file paths. Every interval seconds they are read again (in a thread, so the event loop
+    keeps running) and the Network in net is updated in place, so many consumers can share it. After a failed poll
+    the waiting time doubles up to max_interval. The events of every update are handed to the subscribers, see
+    subscribe(). vpn_only_nodes is used for the Network from the first poll on.
+
+    """
+
+    def __init__(self, nodes_json_location, graph_json_location, interval=60, max_interval=3600, streaming=False,
+                 cache_dir=None, timeout=None, vpn_only_nodes=(), instrumentation=None):
+        self.nodes_json_location = nodes_json_location
+        self.graph_json_location = graph_json_location
+        self.interval = interval
+        self.max_interval = max_interval
+        self.streaming = streaming
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.vpn_only_nodes = set(vpn_only_nodes)
+        self.instrumentation = instrumentation
+        self.net = None  # the current Network, None until the first successful poll
+        self.failures = 0  # number of failed polls in a row
+        self._subscribers = []  # tuples of callback and event types
+        self._task = None
+
+    def subscribe(self, callback, *event_types):
+        """
+        Call callback with every WatchEvent that is an instance of one of event_types, or with all if none are given.
+
+        callback may be a coroutine function, it is awaited before the next event is handed out.
+
+        """
+        self._subscribers.append((callback, event_types or (WatchEvent,)))
+
+    def unsubscribe(self, callback):
+        self._subscribers = [subscriber for subscriber in self._subscribers if subscriber[0] != callback]
+
+    def _generate(self):
+        if _is_url(self.nodes_json_location) and _is_url(self.graph_json_location):
+            return generate_from_urls(self.nodes_json_location, self.graph_json_location, self.streaming,
+                                      cache_dir=self.cache_dir, timeout=self.timeout,
+                                      instrumentation=self.instrumentation)
+        return generate_from_files(self.nodes_json_location, self.graph_json_location, self.streaming,
+                                   instrumentation=self.instrumentation)
+
+    async def poll(self):
+        """Read the snapshot once, update net and notify the subscribers. Returns the ChangeReport, None at first."""
+        import asyncio
+        new_net = await asyncio.get_event_loop().run_in_executor(None, self._generate)
+        if self.net is None:
+            new_net.vpn_only_nodes.update(self.vpn_only_nodes)
+            self.net = new_net
+            return None
+        # The update runs in the event loop, so subscribers never see a half updated Network.
+        report = self.net.update(new_net)
+        await self._notify(get_events(report))
+        return report
+
+    async def _notify(self, events):
+        import asyncio
+        import logging
+        for event in events:
+            for callback, event_types in list(self._subscribers):
+                if not isinstance(event, event_types):
+                    continue
+                try:
+                    result = callback(event)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception:
+                    logging.getLogger('nodesTk').exception("Subscriber %r failed on %r", callback, event)
+
+    async def run(self):
+        """Poll until stop() is called or the task is cancelled."""
+        import asyncio
+        import logging
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                logging.getLogger('nodesTk').warning("Polling %s failed", self.nodes_json_location, exc_info=True)
+            else:
+                self.failures = 0
+            await asyncio.sleep(min(self.interval * 2 ** self.failures, self.max_interval))
+
+    def start(self):
+        """Run the Watcher as a task of the current event loop and return the task."""
+        import asyncio
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _jsonable(value):
+    """Turn sets, frozensets and tuples into lists (sets sorted) so that value can be written as JSON."""
+    if isinstance(value, (set, frozenset)):
+        return sorted(_jsonable(item) for item in value)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, Version):
+        return str(value)
+    return value
+
+
+def _load_network(parser, nodes_json, graph_json, snapshot, vpn_only_nodes_path=None, streaming=False,
+                  cache_dir=None, timeout=None):
+    """
+    Load the Network for the command line interface.
+
+    With nodes_json and graph_json (paths or URLs) a snapshot path works as cache: it is read instead of the JSON
+    files as long as it is newer than both, and written again otherwise. Without them only the snapshot is read.
+
+    """
+    if (nodes_json is None) != (graph_json is None):
+        parser.error("the nodes.json and the graph.json have to be given together")
+    if nodes_json is None and snapshot is None:
+        parser.error("give a nodes.json and a graph.json or a snapshot")
+    generated = False
+    try:
+        if nodes_json is None:
+            net = Network.load(snapshot)
+        elif snapshot is not None and not _is_url(nodes_json) and not _is_url(graph_json) and \
+                os.path.exists(snapshot) and \
+                os.path.getmtime(snapshot) >= max(os.path.getmtime(nodes_json), os.path.getmtime(graph_json)):
+            net = Network.load(snapshot)
+        elif _is_url(nodes_json) and _is_url(graph_json):
+            net = generate_from_urls(nodes_json, graph_json, streaming, cache_dir=cache_dir, timeout=timeout)
+            generated = True
+        else:
+            net = generate_from_files(nodes_json, graph_json, streaming)
+            generated = True
+        if vpn_only_nodes_path is not None:
+            with open(vpn_only_nodes_path) as f:
+                net.vpn_only_nodes.update(json.load(f))
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        parser.error("cannot load the network: {}: {}".format(type(e).__name__, e))
+    if generated and snapshot is not None:
+        # Other processes may read the snapshot at the same time, so it is replaced in one step.
+        temporary_path = "{}.{}.tmp".format(snapshot, os.getpid())
+        net.save(temporary_path)
+        os.replace(temporary_path, snapshot)
+    return net
+
+
+def _write_line(output, document):
+    output.write(json.dumps(document, sort_keys=True))
+    output.write("\n")
+
+
+def _is_unknown(net, node_id):
+    """Return whether net knows nothing about node_id, and report it on standard error if so."""
+    if node_id in net.nodes_dict or node_id in net.adjacency_dict:
+        return False
+    sys.stderr.write("unknown node {}\n".format(node_id))
+    return True
+
+
+def _cli_neighbours(net, args, output):
+    status = 0
+    for node_id in args.node_ids:
+        if _is_unknown(net, node_id):
+            status = 1
+            continue
+        _write_line(output, {'node_id': node_id,
+                             'neighbours': _jsonable(net.get_neighbours_of_node(node_id, args.vpn))})
+    return status
+
+
+def _cli_tier(net, args, output):
+    if not args.node_ids:
+        for tier, count in net.get_tier_histogram().items():
+            _write_line(output, {'tier': tier, 'nodes': count})
+        return 0
+    status = 0
+    for node_id in args.node_ids:
+        if _is_unknown(net, node_id):
+            status = 1
+            continue
+        _write_line(output, {'node_id': node_id, 'tier': net.get_tier_of_node(node_id)})
+    return status
+
+
+def _cli_meshes(net, args, output):
+    if args.node_id is not None and _is_unknown(net, args.node_id):
+        return 1
+    meshes = net.get_meshes()
+    if args.node_id is not None:
+        meshes = [net.get_mesh_of_node(args.node_id)]
+    for mesh in sorted(meshes, key=lambda mesh: (-len(mesh), min(mesh))):
+        _write_line(output, {'size': len(mesh), 'nodes': sorted(mesh)})
+    return 0
+
+
+def _cli_path(net, args, output):
+    if _is_unknown(net, args.node_id) or (args.target is not None and _is_unknown(net, args.target)):
+        return 1
+    if args.target is None:
+        path = net.get_uplink_path(args.node_id)
+        quality = net.get_uplink_quality(args.node_id)
+    else:
+        quality, path = net.get_best_path(args.node_id, args.target) or (None, None)
+    _write_line(output, {'node_id': args.node_id, 'target': path[-1] if path else args.target, 'quality': quality,
+                         'path': path})
+    return 0 if path else 1
+
+
+def _cli_stats(net, args, output):
+    nodes = net.nodes_dict.values()
+    _write_line(output, {
+        'timestamp': net.timestamp,
+        'nodes': len(net.nodes_dict),
+        'online_nodes': sum(1 for node in nodes if node.is_online),
+        'gateways': sum(1 for node in nodes if node.is_gateway and node.is_online),
+        'clients': sum(node.client_count or 0 for node in nodes if node.is_online),
+        'links': len(net.links_dict),
+        'vpn_links': sum(1 for link in net.links_dict.values() if link.vpn),
+        'meshes': len(net.get_meshes()),
+        'tiers': _jsonable(net.get_tier_histogram()),
+    })
+    return 0
+
+
+def _cli_diff(net, args, output):
+    old_net = _load_network(args.parser, args.old_nodes_json, args.old_graph_json, args.old_snapshot,
+                            args.vpn_only_nodes, args.streaming, args.cache_dir, args.timeout)
+    report = old_net.update(net)
+    for change, value in sorted(vars(report).items()):
+        if isinstance(value, dict):
+            for node_id, (old, new) in sorted(value.items()):
+                _write_line(output, {'change': change, 'id': node_id, 'old': old, 'new': new})
+            continue
+        for item in _jsonable(value):
+            if isinstance(item, list):
+                _write_line(output, {'change': change, 'old': item[0], 'new': item[1]})
+            else:
+                _write_line(output, {'change': change, 'id': item})
+    return 0
+
+
+def _export_jsonl(net, output):
+    """Write every node and every link of net as a line of JSON."""
+    for node_id, node in sorted(net.nodes_dict.items()):
+        document = {field: _jsonable(getattr(node, field)) for field in Node.FIELDS}
+        document['type'] = 'node'
+        _write_line(output, document)
+    for link_id, link in sorted(net.links_dict.items()):
+        _write_line(output, {'type': 'link', 'source': link.source, 'target': link.target, 'vpn': link.vpn,
+                             'tq': link.tq, 'bidirect': link.bidirect})
+
+
+# format name of the command line interface as key and function that writes net to a text file object as value
+_EXPORT_FORMATS = {
+    'jsonl': _export_jsonl,
+    'graphml': export_graphml,
+    'gexf': export_gexf,
+    'dot': export_dot,
+    'geojson': export_geojson,
+    'csv': export_edge_list,
+}
+
+
+def _cli_export(net, args, output):
+    if args.format == 'snapshot':
+        net.save(sys.stdout.buffer if args.output is None else args.output)
+    elif args.output is None:
+        _EXPORT_FORMATS[args.format](net, output)
+    else:
+        with open(args.output, "w", newline="") as f:
+            _EXPORT_FORMATS[args.format](net, f)
+    return 0
+
+
+def main(argv=None):
+    """Run the command line interface with argv (default: sys.argv[1:]) and return the exit status."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Query a Freifunk network given by its nodes.json and graph.json.")
+    parser.add_argument('-n', '--nodes-json', help="path or URL of the nodes.json")
+    parser.add_argument('-g', '--graph-json', help="path or URL of the graph.json")
+    parser.add_argument('-s', '--snapshot', help="binary snapshot, used as cache if the JSON files are given")
+    parser.add_argument('--vpn-only-nodes', help="JSON file with a list of VPN only node ids, e.g. supernodes")
+    parser.add_argument('--streaming', action='store_true', help="parse the JSON files item by item")
+    parser.add_argument('--cache-dir', help="directory to keep downloaded files in")
+    parser.add_argument('--timeout', type=float, help="timeout for downloads in seconds")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    subparser = subparsers.add_parser('neighbours', help="neighbours of nodes")
+    subparser.add_argument('node_ids', nargs='+', metavar='node_id')
+    subparser.add_argument('--vpn', action='store_true', help="include neighbours over VPN links")
+    subparser.set_defaults(function=_cli_neighbours)
+
+    subparser = subparsers.add_parser('tier', help="tiers of nodes, or the tier histogram")
+    subparser.add_argument('node_ids', nargs='*', metavar='node_id')
+    subparser.set_defaults(function=_cli_tier)
+
+    subparser = subparsers.add_parser('meshes', help="online meshes, largest first, or the mesh of a node")
+    subparser.add_argument('node_id', nargs='?')
+    subparser.set_defaults(function=_cli_meshes)
+
+    subparser = subparsers.add_parser('path', help="best path of a node to a gateway or to another node")
+    subparser.add_argument('node_id')
+    subparser.add_argument('target', nargs='?')
+    subparser.set_defaults(function=_cli_path)
+
+    subparser = subparsers.add_parser('stats', help="summary of the network")
+    subparser.set_defaults(function=_cli_stats)
+
+    subparser = subparsers.add_parser('diff', help="changes from an older snapshot to this one")
+    subparser.add_argument('--old-nodes-json', help="path or URL of the older nodes.json")
+    subparser.add_argument('--old-graph-json', help="path or URL of the older graph.json")
+    subparser.add_argument('--old-snapshot', help="older binary snapshot")
+    subparser.set_defaults(function=_cli_diff)
+
+    subparser = subparsers.add_parser('export', help="write the network in another format")
+    subparser.add_argument('-f', '--format', choices=sorted(_EXPORT_FORMATS) + ['snapshot'], default='jsonl')
+    subparser.add_argument('-o', '--output', help="output file, default: standard output")
+    subparser.set_defaults(function=_cli_export)
+
+    args = parser.parse_args(argv)
+    args.parser = parser
+    net = _load_network(parser, args.nodes_json, args.graph_json, args.snapshot, args.vpn_only_nodes, args.streaming,
+                        args.cache_dir, args.timeout)
+    return args.function(net, args, sys.stdout)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
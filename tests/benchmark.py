@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""
+Time the main operations of nodesTk on synthetic networks of different sizes.
+
+Every operation runs on a freshly loaded network, so the caches of the Network are cold. The best time of all
+repetitions and the peak memory of one extra traced run are reported. The results are appended to a JSON file, and
+each run is compared to the previous one for the same size.
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import nodesTk
+import synthetic
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def _load(paths, streaming=False):
+    net = nodesTk.generate_from_files(paths[0], paths[1], streaming=streaming)
+    with open(paths[2]) as f:
+        net.vpn_only_nodes.update(json.load(f))
+    return net
+
+
+def _all_tiers(net):
+    tier = 0
+    while net.get_nodes_in_tier(tier):
+        tier += 1
+
+
+def _all_neighbours(net):
+    for node_id in net.nodes_dict:
+        net.get_neighbours_of_node(node_id, vpn_neighbours=True)
+
+
+# name, function that prepares its argument, function that is measured
+OPERATIONS = (
+    ("generate_from_files", lambda paths: paths, _load),
+    ("generate_from_files streaming", lambda paths: paths, lambda paths: _load(paths, streaming=True)),
+    ("get_meshes", _load, lambda net: net.get_meshes()),
+    ("get_nodes_in_tier", _load, _all_tiers),
+    ("get_neighbours_of_node", _load, _all_neighbours),
+    ("get_mesh_summaries", _load, lambda net: net.get_mesh_summaries()),
+)
+
+
+def _measure(prepare, operation, paths, repeat):
+    best = None
+    for _ in range(repeat):
+        argument = prepare(paths)
+        start = time.perf_counter()
+        operation(argument)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    argument = prepare(paths)
+    tracemalloc.start()
+    try:
+        operation(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, data_directory, repeat):
+    """Run all OPERATIONS for all sizes and return a run record."""
+    results = []
+    for size in sizes:
+        directory = os.path.join(data_directory, str(size))
+        paths = tuple(os.path.join(directory, name) for name in ("nodes.json", "graph.json", "vpn_only_nodes.json"))
+        if not all(os.path.exists(path) for path in paths):
+            paths = synthetic.write(directory, size)
+        for name, prepare, operation in OPERATIONS:
+            seconds, peak_memory = _measure(prepare, operation, paths, repeat)
+            results.append({"size": size, "operation": name, "seconds": seconds, "peak_memory": peak_memory})
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def report(record, previous_record=None):
+    previous_dict = dict()
+    if previous_record:
+        previous_dict = {(result["size"], result["operation"]): result for result in previous_record["results"]}
+    print("{:>7}  {:<30} {:>10} {:>12} {:>9}".format("size", "operation", "seconds", "peak MiB", "vs. last"))
+    for result in record["results"]:
+        previous = previous_dict.get((result["size"], result["operation"]))
+        change = "{:+.0%}".format(result["seconds"] / previous["seconds"] - 1) if previous else ""
+        print("{:>7}  {:<30} {:>10.4f} {:>12.1f} {:>9}".format(result["size"], result["operation"], result["seconds"],
+                                                              result["peak_memory"] / 2 ** 20, change))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--data-directory', default="benchmark_data",
+                        help="where the synthetic networks are generated once and kept")
+    parser.add_argument('--output', default="benchmark_results.json", help="JSON file the runs are appended to")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    runs = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            runs = json.load(f)
+    new_run = run(args.sizes, args.data_directory, args.repeat)
+    report(new_run, runs[-1] if runs else None)
+    runs.append(new_run)
+    with open(args.output, "w") as f:
+        json.dump(runs, f, indent=1)
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+"""
+Generate synthetic nodes.json and graph.json files that look like a Freifunk community.
+
+The network consists of gateways, VPN only supernodes, nodes with a VPN uplink and meshes of nodes behind them.
+Some of the links to the supernodes are not flagged as VPN, so they show up as fake mesh connections as soon as the
+supernodes are added to Network.vpn_only_nodes.
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+
+RELEASES = (("0.14f-20170411", 80), ("0.14e-20170313", 6), ("0.14b-20161223", 4), ("0.14a-20161112", 3),
+            ("0.12e-20160814", 3), ("0.12a-20160219", 2), (None, 2))
+CENTER = (52.375, 9.732)
+
+
+def _node_id(number):
+    return "{:012x}".format(0x02aa00000000 + number)
+
+
+def _mac(node_id):
+    return ":".join(node_id[i:i + 2] for i in range(0, 12, 2))
+
+
+def generate(node_count, seed=0):
+    """
+    Return a tuple of the nodes.json and graph.json documents of a synthetic network and the list of VPN only nodes.
+
+    The graph.json links between nodes refer to indices of its node list, like the real one.
+
+    """
+    rng = random.Random(seed)
+    gateway_count = max(2, node_count // 150)
+    supernode_count = max(1, node_count // 500)
+    node_ids = [_node_id(number) for number in range(node_count)]
+    gateways = node_ids[:gateway_count]
+    supernodes = node_ids[gateway_count:gateway_count + supernode_count]
+    other_nodes = node_ids[gateway_count + supernode_count:]
+    online_dict = {node_id: node_id in gateways or node_id in supernodes or rng.random() < 0.8
+                   for node_id in node_ids}
+
+    links = []  # (source, target, vpn, tq)
+
+    def add_link(source, target, vpn):
+        links.append((source, target, vpn, 1.0 if vpn else round(1 + rng.expovariate(2.0), 7)))
+
+    # Meshes of 1 to about 40 nodes, roughly half of the nodes have a VPN uplink of their own.
+    location_dict = dict()
+    position = 0
+    while position < len(other_nodes):
+        size = min(len(other_nodes) - position, 1 + int(rng.expovariate(0.3)))
+        mesh = other_nodes[position:position + size]
+        position += size
+        mesh_center = (CENTER[0] + rng.gauss(0, 0.08), CENTER[1] + rng.gauss(0, 0.12))
+        for i, node_id in enumerate(mesh):
+            location_dict[node_id] = (round(mesh_center[0] + rng.gauss(0, 0.0008), 6),
+                                      round(mesh_center[1] + rng.gauss(0, 0.0012), 6))
+            if not online_dict[node_id]:
+                continue
+            if i > 0:
+                # a random tree inside the mesh plus a few extra links
+                add_link(node_id, mesh[rng.randrange(i)], False)
+                if i > 2 and rng.random() < 0.2:
+                    add_link(node_id, mesh[rng.randrange(i)], False)
+            if i == 0 or rng.random() < 0.4:
+                if rng.random() < 0.03:
+                    # the VPN flag of links to supernodes is sometimes wrong
+                    add_link(node_id, rng.choice(supernodes), False)
+                else:
+                    add_link(node_id, rng.choice(gateways), True)
+                if rng.random() < 0.3:
+                    add_link(node_id, rng.choice(gateways), True)
+    for supernode in supernodes:
+        for gateway in gateways:
+            add_link(supernode, gateway, True)
+
+    timestamp = datetime.datetime(2017, 7, 28, 22, 54, 13, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    nodes = []
+    for node_id in node_ids:
+        release = rng.choices([release for release, _ in RELEASES], [weight for _, weight in RELEASES])[0]
+        nodeinfo = {
+            "node_id": node_id,
+            "network": {"mac": _mac(node_id), "addresses": ["fdca:ffee:8:0::{}".format(node_id[-4:])]},
+            "hostname": "synthetic-{}".format(node_id),
+        }
+        if release:
+            nodeinfo["software"] = {"firmware": {"release": release}}
+        if node_id in location_dict and rng.random() < 0.85:
+            latitude, longitude = location_dict[node_id]
+            nodeinfo["location"] = {"latitude": latitude, "longitude": longitude}
+        nodes.append({
+            "firstseen": "2017-01-01T00:00:00+0100",
+            "lastseen": timestamp.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "flags": {"online": online_dict[node_id], "gateway": node_id in gateways},
+            "statistics": {"node_id": node_id,
+                           "clients": rng.randrange(30) if online_dict[node_id] and node_id not in gateways else 0},
+            "nodeinfo": nodeinfo,
+        })
+
+    index_dict = {node_id: i for i, node_id in enumerate(node_ids)}
+    nodes_json = {"version": 2, "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%S%z"), "nodes": nodes}
+    graph_json = {"version": 1, "batadv": {
+        "directed": False,
+        "graph": None,
+        "nodes": [{"id": _mac(node_id), "node_id": node_id} for node_id in node_ids],
+        "links": [{"source": index_dict[source], "target": index_dict[target], "vpn": vpn, "tq": tq,
+                   "bidirect": not vpn} for source, target, vpn, tq in links],
+    }}
+    return nodes_json, graph_json, supernodes
+
+
+def write(directory, node_count, seed=0):
+    """Write nodes.json, graph.json and vpn_only_nodes.json to directory and return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    nodes_json, graph_json, supernodes = generate(node_count, seed)
+    paths = tuple(os.path.join(directory, name) for name in ("nodes.json", "graph.json", "vpn_only_nodes.json"))
+    for path, document in zip(paths, (nodes_json, graph_json, supernodes)):
+        with open(path, "w") as f:
+            json.dump(document, f, separators=(",", ":"))
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('node_count', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for written_path in write(args.directory, args.node_count, args.seed):
+        print(written_path)